@@ -0,0 +1,97 @@
+# Copyright 2022 Alexander Huntley
+
+# This file is part of Plots.
+
+# Plots is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Plots is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+import heapq
+from collections import defaultdict, namedtuple
+
+# The name a row defines, or None, and the names it refers to
+Node = namedtuple("Node", "name references")
+
+
+class DependencyGraph():
+    """Which rows depend on which, through the names that rows define.
+
+    nodes maps each row to its Node, in document order. A reference to a
+    name that no row defines is kept, so that defining it later can find
+    the rows which refer to it.
+    """
+    def __init__(self, nodes):
+        self.nodes = dict(nodes)
+        self.definers = defaultdict(list)
+        self.users = defaultdict(list)
+        for row, node in self.nodes.items():
+            if node.name is not None:
+                self.definers[node.name].append(row)
+            for name in node.references:
+                self.users[name].append(row)
+
+    def dependencies(self, row):
+        """Return the rows which define the names row refers to."""
+        return [dependency for name in self.nodes[row].references
+                for dependency in self.definers.get(name, ())]
+
+    def dependents(self, names):
+        """Return the set of rows which refer to any of names, directly or
+        through other rows."""
+        result, stack = set(), list(names)
+        while stack:
+            for row in self.users.get(stack.pop(), ()):
+                if row not in result:
+                    result.add(row)
+                    name = self.nodes[row].name
+                    if name is not None:
+                        stack.append(name)
+        return result
+
+    def needed(self, rows):
+        """Return the set of rows, together with all the rows they depend on
+        directly or indirectly."""
+        result, stack = set(), list(rows)
+        while stack:
+            row = stack.pop()
+            if row not in result:
+                result.add(row)
+                stack.extend(self.dependencies(row))
+        return result
+
+    def order(self, key=lambda row: 0):
+        """Sort the rows so that each comes after the rows it depends on.
+
+        Among the rows whose dependencies are already placed, the one with
+        the smallest key comes first, then the earliest in the document.
+        Returns the sorted rows and a list of the rows which can't be
+        placed, because they are on a cycle or depend on one.
+        """
+        index = {row: i for i, row in enumerate(self.nodes)}
+        waiting = {row: len(set(self.dependencies(row))) for row in self.nodes}
+        dependents = defaultdict(set)
+        for row in self.nodes:
+            for dependency in self.dependencies(row):
+                dependents[dependency].add(row)
+        ready = [(key(row), index[row], row) for row, count in waiting.items()
+                 if count == 0]
+        heapq.heapify(ready)
+        result = []
+        while ready:
+            _, _, row = heapq.heappop(ready)
+            result.append(row)
+            for dependent in dependents[row]:
+                waiting[dependent] -= 1
+                if waiting[dependent] == 0:
+                    heapq.heappush(ready, (key(dependent), index[dependent], dependent))
+        placed = set(result)
+        return result, [row for row in self.nodes if row not in placed]
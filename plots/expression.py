@@ -0,0 +1,723 @@
+# Copyright 2022 Alexander Huntley
+
+# This file is part of Plots.
+
+# Plots is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Plots is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Expression trees for the GLSL produced by ElementList.to_glsl.
+
+The element tree emits GLSL source directly, so rather than duplicating that
+logic the generated expression is parsed back into a small tree of Num, Var,
+Neg, BinOp and Call nodes, which can then be optimised and emitted in other
+forms.
+"""
+
+import re
+import math
+from collections import Counter, namedtuple
+
+import numpy as np
+
+Num = namedtuple("Num", "value")
+Var = namedtuple("Var", "name")
+Neg = namedtuple("Neg", "operand")
+BinOp = namedtuple("BinOp", "op left right")
+Call = namedtuple("Call", "name args")
+
+
+class ExpressionError(ValueError):
+    pass
+
+
+TOKEN = re.compile(r"\s*(?:(\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)"
+                   r"|([A-Za-z_]\w*)|(.))")
+
+
+def tokenize(source):
+    tokens = []
+    for number, name, symbol in TOKEN.findall(source):
+        if number:
+            tokens.append(Num(float(number)))
+        elif name:
+            tokens.append(name)
+        elif symbol.strip():
+            tokens.append(symbol)
+    return tokens
+
+
+class Parser():
+    def __init__(self, source):
+        self.tokens = tokenize(source)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise ExpressionError("unexpected end of expression")
+        self.pos += 1
+        return token
+
+    def expect(self, symbol):
+        token = self.next()
+        if token != symbol:
+            raise ExpressionError(f"expected {symbol!r}, found {token!r}")
+
+    def parse(self):
+        node = self.additive()
+        if self.peek() is not None:
+            raise ExpressionError(f"unexpected {self.peek()!r}")
+        return node
+
+    def additive(self):
+        node = self.multiplicative()
+        while self.peek() in ("+", "-"):
+            node = BinOp(self.next(), node, self.multiplicative())
+        return node
+
+    def multiplicative(self):
+        node = self.unary()
+        while self.peek() in ("*", "/"):
+            node = BinOp(self.next(), node, self.unary())
+        return node
+
+    def unary(self):
+        if self.peek() == "-":
+            self.next()
+            return Neg(self.unary())
+        if self.peek() == "+":
+            self.next()
+            return self.unary()
+        return self.primary()
+
+    def primary(self):
+        token = self.next()
+        if isinstance(token, Num):
+            return token
+        if token == "(":
+            node = self.additive()
+            self.expect(")")
+            return node
+        if not isinstance(token, str) or not re.match(r"[A-Za-z_]", token):
+            raise ExpressionError(f"unexpected {token!r}")
+        if self.peek() != "(":
+            return Var(token)
+        self.next()
+        args = []
+        if self.peek() != ")":
+            args.append(self.additive())
+            while self.peek() == ",":
+                self.next()
+                args.append(self.additive())
+        self.expect(")")
+        return Call(token, tuple(args))
+
+
+def parse(source):
+    """Parse a GLSL expression, as produced by to_glsl, into a tree.
+
+    Raises ExpressionError for anything outside the arithmetic subset that
+    to_glsl uses.
+    """
+    return Parser(source).parse()
+
+
+def variables(node):
+    """Return the set of names of the variables in node."""
+    if isinstance(node, Var):
+        return {node.name}
+    if isinstance(node, Num):
+        return set()
+    if isinstance(node, Neg):
+        return variables(node.operand)
+    if isinstance(node, BinOp):
+        return variables(node.left) | variables(node.right)
+    return set().union(*map(variables, node.args))
+
+
+def inverse(name):
+    return lambda x: Call(name, (BinOp("/", Num(1.0), x),))
+
+
+def reciprocal(name):
+    return lambda x: BinOp("/", Num(1.0), Call(name, (x,)))
+
+
+def renamed(name):
+    return lambda x: Call(name, (x,))
+
+
+# Functions that common.glsl defines as macros, in terms of other functions
+MACROS = {
+    "ln": renamed("log"),
+    "lg": renamed("log2"),
+    "sgn": renamed("sign"),
+    "arcsin": renamed("asin"),
+    "arccos": renamed("acos"),
+    "arctan": renamed("atan"),
+    "sec": reciprocal("cos"),
+    "csc": reciprocal("sin"),
+    "cosec": reciprocal("sin"),
+    "cot": reciprocal("tan"),
+    "asec": inverse("acos"),
+    "acsc": inverse("asin"),
+    "acosec": inverse("asin"),
+    "arcsec": inverse("acos"),
+    "arccsc": inverse("asin"),
+    "arccosec": inverse("asin"),
+    "arccot": renamed("acot"),
+    "sech": reciprocal("cosh"),
+    "csch": reciprocal("sinh"),
+    "cosech": reciprocal("sinh"),
+    "coth": reciprocal("tanh"),
+    "asech": inverse("acosh"),
+    "acsch": inverse("asinh"),
+    "acosech": inverse("asinh"),
+    "acoth": inverse("atanh"),
+    "sinc": lambda x: BinOp("/", Call("sin", (x,)), x),
+}
+
+# Functions with a dual number counterpart, d_<name>, in dual.glsl, and the
+# number of arguments they take
+DUAL_FUNCTIONS = {
+    "sin": 1, "cos": 1, "tan": 1, "asin": 1, "acos": 1, "atan": 1, "acot": 1,
+    "sinh": 1, "cosh": 1, "tanh": 1, "asinh": 1, "acosh": 1, "atanh": 1,
+    "exp": 1, "log": 1, "log2": 1, "sqrt": 1, "abs": 1, "sign": 1,
+    "floor": 1, "ceil": 1, "factorial": 1, "pow": 2, "mypow": 2,
+}
+
+# Functions with an interval counterpart, i_<name>, in interval.glsl: the same
+# as for dual numbers
+INTERVAL_FUNCTIONS = DUAL_FUNCTIONS
+
+
+def expand(node):
+    """Rewrite calls of the macros in common.glsl into the functions they
+    are defined by."""
+    if isinstance(node, Neg):
+        return Neg(expand(node.operand))
+    if isinstance(node, BinOp):
+        return BinOp(node.op, expand(node.left), expand(node.right))
+    if isinstance(node, Call):
+        args = tuple(map(expand, node.args))
+        if node.name == "log_base" and len(args) == 2:
+            return BinOp("/", Call("log", args[1:]), Call("log", args[:1]))
+        if node.name in MACROS and len(args) == 1:
+            return expand(MACROS[node.name](args[0]))
+        return Call(node.name, args)
+    return node
+
+
+def number(value):
+    return repr(float(value))
+
+
+def to_glsl(node):
+    """Emit node as a float GLSL expression."""
+    if isinstance(node, Num):
+        return number(node.value)
+    if isinstance(node, Var):
+        return node.name
+    if isinstance(node, Neg):
+        return f"(-{to_glsl(node.operand)})"
+    if isinstance(node, BinOp):
+        return f"({to_glsl(node.left)} {node.op} {to_glsl(node.right)})"
+    return f"{node.name}({', '.join(map(to_glsl, node.args))})"
+
+
+def transform(node, function):
+    """Rebuild node bottom up, replacing each subtree by function(subtree)."""
+    if isinstance(node, Neg):
+        node = Neg(transform(node.operand, function))
+    elif isinstance(node, BinOp):
+        node = BinOp(node.op, transform(node.left, function),
+                     transform(node.right, function))
+    elif isinstance(node, Call):
+        node = Call(node.name, tuple(transform(arg, function) for arg in node.args))
+    return function(node)
+
+
+def subtrees(node):
+    yield node
+    if isinstance(node, Neg):
+        yield from subtrees(node.operand)
+    elif isinstance(node, BinOp):
+        yield from subtrees(node.left)
+        yield from subtrees(node.right)
+    elif isinstance(node, Call):
+        for arg in node.args:
+            yield from subtrees(arg)
+
+
+def glsl_factorial(x):
+    if not math.isfinite(x) or x < 0:
+        return math.nan
+    if x > 170:
+        # 171! is too big for a double, and looping up to x could take minutes
+        return math.inf
+    result = 1.0
+    for i in range(1, math.floor(x) + 1):
+        result *= i
+    return result
+
+
+def glsl_mypow(x, y):
+    if x >= 0:
+        return x ** y
+    if math.floor(y) == y:
+        return (-x) ** y * (1 if int(y) % 2 == 0 else -1)
+    return math.inf
+
+
+# Python equivalents of GLSL functions, for folding calls with constant
+# arguments
+FOLDABLE = {
+    "sin": math.sin, "cos": math.cos, "tan": math.tan,
+    "asin": math.asin, "acos": math.acos, "atan": math.atan,
+    "sinh": math.sinh, "cosh": math.cosh, "tanh": math.tanh,
+    "asinh": math.asinh, "acosh": math.acosh, "atanh": math.atanh,
+    "exp": math.exp, "log": math.log, "log2": math.log2, "sqrt": math.sqrt,
+    "abs": abs, "floor": math.floor, "ceil": math.ceil,
+    "sign": lambda x: float((x > 0) - (x < 0)),
+    "factorial": glsl_factorial, "mypow": glsl_mypow,
+    "pow": lambda x, y: x ** y if x >= 0 else math.nan,
+}
+
+CONSTANTS = {"pi": math.pi, "e": math.e}
+
+ARITHMETIC = {
+    "+": lambda a, b: a + b,
+    "-": lambda a, b: a - b,
+    "*": lambda a, b: a * b,
+    "/": lambda a, b: a / b,
+}
+
+
+def folded(function, *args):
+    """Return Num(function(*args)), or None if it isn't a finite number."""
+    try:
+        value = float(function(*args))
+    except (ValueError, ArithmeticError):
+        return None
+    return Num(value) if math.isfinite(value) else None
+
+
+def fold_node(node):
+    if isinstance(node, Var) and node.name in CONSTANTS:
+        return Num(CONSTANTS[node.name])
+    if isinstance(node, Neg):
+        if isinstance(node.operand, Num):
+            return Num(-node.operand.value)
+        if isinstance(node.operand, Neg):
+            return node.operand.operand
+    if isinstance(node, BinOp):
+        left, right = node.left, node.right
+        if isinstance(left, Num) and isinstance(right, Num):
+            return folded(ARITHMETIC[node.op], left.value, right.value) or node
+        # identities which hold for every float, including NaN and infinity
+        if node.op in "+-" and right == Num(0.0) \
+           or node.op in "*/" and right == Num(1.0):
+            return left
+        if node.op == "+" and left == Num(0.0) or node.op == "*" and left == Num(1.0):
+            return right
+        if node.op == "-" and left == Num(0.0):
+            return Neg(right)
+        if node.op in "+-" and isinstance(right, Num) and right.value < 0:
+            return BinOp("+" if node.op == "-" else "-", left, Num(-right.value))
+    if isinstance(node, Call) and node.name in FOLDABLE \
+       and all(isinstance(arg, Num) for arg in node.args):
+        return folded(FOLDABLE[node.name], *(arg.value for arg in node.args)) or node
+    return node
+
+
+def fold(node):
+    """Evaluate the parts of node which only involve constants."""
+    return transform(node, fold_node)
+
+
+def power(base, n):
+    """Return base**n for a positive integer n as multiplications, squaring
+    so that common subexpression elimination can share the factors."""
+    if n == 1:
+        return base
+    half = power(base, n // 2)
+    result = BinOp("*", half, half)
+    return BinOp("*", result, base) if n % 2 else result
+
+
+# highest integer power replaced by multiplications
+MAX_POWER = 8
+
+
+def reduce_node(node):
+    if isinstance(node, Call) and node.name == "mypow" \
+       and isinstance(node.args[1], Num):
+        n = node.args[1].value
+        if n == math.floor(n) and 1 <= abs(n) <= MAX_POWER:
+            product = power(node.args[0], int(abs(n)))
+            return product if n > 0 else BinOp("/", Num(1.0), product)
+    return node
+
+
+def strength_reduce(node):
+    """Replace mypow with a small integer exponent by multiplications, which
+    are cheaper and, unlike pow, defined for negative bases."""
+    return transform(node, reduce_node)
+
+
+def polynomial(node, var):
+    """Return node as a polynomial in the variable var, as a dictionary from
+    powers to coefficients which don't depend on var, or None if it isn't
+    one."""
+    if var not in variables(node):
+        return {0: node}
+    if node == Var(var):
+        return {1: Num(1.0)}
+    if isinstance(node, Neg):
+        p = polynomial(node.operand, var)
+        return p and {k: Neg(c) for k, c in p.items()}
+    if isinstance(node, BinOp) and node.op in "+-":
+        left = polynomial(node.left, var)
+        right = polynomial(node.right, var)
+        if left is None or right is None:
+            return None
+        result = dict(left)
+        for k, c in right.items():
+            c = c if node.op == "+" else Neg(c)
+            result[k] = BinOp("+", result[k], c) if k in result else c
+        return result
+    if isinstance(node, BinOp) and node.op == "*":
+        left = polynomial(node.left, var)
+        right = polynomial(node.right, var)
+        if left is None or right is None:
+            return None
+        result = {}
+        for i, a in left.items():
+            for j, b in right.items():
+                c = BinOp("*", a, b)
+                result[i + j] = BinOp("+", result[i + j], c) if i + j in result else c
+        return result if max(result) <= MAX_POWER else None
+    if isinstance(node, BinOp) and node.op == "/" and var not in variables(node.right):
+        p = polynomial(node.left, var)
+        return p and {k: BinOp("/", c, node.right) for k, c in p.items()}
+    if isinstance(node, Call) and node.name == "mypow" \
+       and isinstance(node.args[1], Num) and node.args[1].value in range(2, MAX_POWER + 1):
+        return polynomial(power(node.args[0], int(node.args[1].value)), var)
+    return None
+
+
+def horner_node(node, var):
+    p = polynomial(node, var)
+    # a lone power is better left to strength_reduce
+    if p is None or max(p) < 2 or len([k for k in p if k > 0]) < 2:
+        return None
+    result = p[max(p)]
+    for k in range(max(p) - 1, -1, -1):
+        result = BinOp("*", result, Var(var))
+        if k in p:
+            result = BinOp("+", result, p[k])
+    return fold(result)
+
+
+def horner(node, var):
+    """Rewrite the largest polynomials in var within node in Horner form."""
+    result = horner_node(node, var)
+    if result is not None:
+        return result
+    if isinstance(node, Neg):
+        return Neg(horner(node.operand, var))
+    if isinstance(node, BinOp):
+        return BinOp(node.op, horner(node.left, var), horner(node.right, var))
+    if isinstance(node, Call):
+        return Call(node.name, tuple(horner(arg, var) for arg in node.args))
+    return node
+
+
+def optimise(node, parameters=()):
+    """Simplify node: expand macros, fold constants, put polynomials in the
+    parameters in Horner form and reduce small integer powers to
+    multiplications."""
+    node = fold(expand(node))
+    for var in parameters:
+        node = horner(node, var)
+    return fold(strength_reduce(node))
+
+
+def children(node):
+    if isinstance(node, Neg):
+        return (node.operand,)
+    if isinstance(node, BinOp):
+        return (node.left, node.right)
+    if isinstance(node, Call):
+        return node.args
+    return ()
+
+
+def to_statements(node, prefix="_t"):
+    """Emit node as GLSL statements and an expression, with each repeated
+    subexpression computed once into a temporary float named prefix<n>.
+
+    The largest repeated subexpressions are shared, so a subexpression only
+    gets a temporary of its own if it is used outside of them too. Returns
+    (statements, expression).
+    """
+    # the uses of each subtree, counting those inside a repeated subtree
+    # only once, since it is computed once
+    uses = Counter()
+
+    def count(tree):
+        uses[tree] += 1
+        if uses[tree] == 1:
+            for child in children(tree):
+                count(child)
+    count(node)
+    names = {}
+    statements = []
+
+    def emit(tree):
+        if tree in names:
+            return Var(names[tree])
+        if not isinstance(tree, (Neg, BinOp, Call)):
+            return tree
+        # temporaries it uses are declared before it
+        args = tuple(emit(child) for child in children(tree))
+        if isinstance(tree, Neg):
+            result = Neg(*args)
+        elif isinstance(tree, BinOp):
+            result = BinOp(tree.op, *args)
+        else:
+            result = Call(tree.name, args)
+        if uses[tree] < 2:
+            return result
+        names[tree] = f"{prefix}{len(names)}"
+        statements.append(f"float {names[tree]} = {to_glsl(result)};\n")
+        return Var(names[tree])
+    expression = to_glsl(emit(node))
+    return "".join(statements), expression
+
+
+def numpy_mypow(x, y):
+    if x >= 0:
+        return np.power(x, y)
+    if np.floor(y) == y:
+        return np.power(-x, y) * (1 if int(y) % 2 == 0 else -1)
+    return np.float64(np.inf)
+
+
+# NumPy equivalents of the GLSL functions, for evaluating on the CPU
+EVALUATORS = {
+    "sin": np.sin, "cos": np.cos, "tan": np.tan,
+    "asin": np.arcsin, "acos": np.arccos, "atan": np.arctan,
+    "acot": lambda x: np.arctan(1/x) - (0 if x > 0 else np.pi),
+    "sinh": np.sinh, "cosh": np.cosh, "tanh": np.tanh,
+    "asinh": np.arcsinh, "acosh": np.arccosh, "atanh": np.arctanh,
+    "exp": np.exp, "log": np.log, "log2": np.log2, "sqrt": np.sqrt,
+    "abs": np.abs, "floor": np.floor, "ceil": np.ceil, "sign": np.sign,
+    "factorial": lambda x: np.float64(glsl_factorial(x)),
+    "mypow": numpy_mypow,
+    "pow": lambda x, y: np.power(x, y) if x >= 0 else np.float64(np.nan),
+}
+
+
+def invariant(node, known):
+    """Return whether node can be evaluated on the CPU given the values of
+    the names in known."""
+    return all(tree.name in known if isinstance(tree, Var) else
+               tree.name in EVALUATORS if isinstance(tree, Call) else True
+               for tree in subtrees(node))
+
+
+def evaluate(node, values):
+    """Evaluate node on the CPU, where values maps names to their values.
+
+    Like in GLSL, invalid operations give NaN or infinity rather than
+    raising. Names missing from values are NaN.
+    """
+    def value(node):
+        if isinstance(node, Num):
+            return np.float64(node.value)
+        if isinstance(node, Var):
+            return np.float64(values.get(node.name, np.nan))
+        if isinstance(node, Neg):
+            return -value(node.operand)
+        if isinstance(node, BinOp):
+            return ARITHMETIC[node.op](value(node.left), value(node.right))
+        return EVALUATORS[node.name](*map(value, node.args))
+    with np.errstate(all="ignore"):
+        return float(value(expand(node)))
+
+
+def hoist(node, known, prefix):
+    """Replace the largest subtrees of node which are invariant given known,
+    other than lone numbers and names, by variables named prefix<n>.
+
+    Returns the new tree and a dictionary from the new names to the subtrees
+    they replace.
+    """
+    names = {}
+
+    def visit(tree):
+        if not isinstance(tree, (Num, Var)) and invariant(tree, known):
+            if tree not in names:
+                names[tree] = f"{prefix}{len(names)}"
+            return Var(names[tree])
+        if isinstance(tree, Neg):
+            return Neg(visit(tree.operand))
+        if isinstance(tree, BinOp):
+            return BinOp(tree.op, visit(tree.left), visit(tree.right))
+        if isinstance(tree, Call):
+            return Call(tree.name, tuple(map(visit, tree.args)))
+        return tree
+    return visit(node), {name: tree for tree, name in names.items()}
+
+
+def lift(node, name):
+    """Replace the numbers in node by the elements of a GLSL array called
+    name, so that trees which only differ in their numbers emit the same
+    code.
+
+    Each number gets its own element, except that repeated subtrees share
+    theirs, so they stay common for to_statements. Returns the new tree and
+    the values of the elements.
+    """
+    values, lifted = [], {}
+
+    def visit(tree):
+        if isinstance(tree, Num):
+            values.append(tree.value)
+            return Var(f"{name}[{len(values) - 1}]")
+        if tree not in lifted:
+            if isinstance(tree, Neg):
+                lifted[tree] = Neg(visit(tree.operand))
+            elif isinstance(tree, BinOp):
+                lifted[tree] = BinOp(tree.op, visit(tree.left), visit(tree.right))
+            elif isinstance(tree, Call):
+                lifted[tree] = Call(tree.name, tuple(map(visit, tree.args)))
+            else:
+                lifted[tree] = tree
+        return lifted[tree]
+    return visit(node), values
+
+
+def to_dual(node, parameters):
+    """Emit node as a GLSL expression in dual numbers.
+
+    The names in parameters are vec3 dual numbers holding a value and its
+    derivatives with respect to x and y; everything else is a float constant.
+    Subexpressions which don't depend on parameters stay as plain floats.
+    Raises ExpressionError if node calls a function that dual.glsl can't
+    differentiate.
+    """
+    return DualEmitter(parameters).emit_lifted(expand(node))
+
+
+def to_interval(node, parameters):
+    """Emit node as a GLSL expression in interval arithmetic.
+
+    The names in parameters are vec2 intervals holding a lower and upper
+    bound, and the result bounds node over them. Raises ExpressionError if
+    node calls a function that interval.glsl has no bounds for.
+    """
+    return IntervalEmitter(parameters).emit_lifted(expand(node))
+
+
+class Emitter():
+    """Emits GLSL for a tree in some other kind of number than float, such
+    as dual numbers or intervals, which the names in parameters are.
+
+    Subclasses give the prefix of the GLSL functions for that kind of
+    number, the functions which exist and the arithmetic operators.
+    """
+    prefix = ""
+    functions = {}
+
+    def __init__(self, parameters):
+        self.parameters = set(parameters)
+
+    def emit(self, node):
+        """Return the GLSL for node and whether it is of the emitted kind,
+        rather than a plain float."""
+        if not variables(node) & self.parameters:
+            return to_glsl(node), False
+        if isinstance(node, Var):
+            return node.name, True
+        if isinstance(node, Neg):
+            return self.negate(self.emit(node.operand)[0]), True
+        if isinstance(node, BinOp):
+            return self.binop(node), True
+        if self.functions.get(node.name) != len(node.args):
+            raise ExpressionError(f"no {self.prefix}{node.name} function")
+        args = ", ".join(self.emit_lifted(arg) for arg in node.args)
+        return f"{self.prefix}{node.name}({args})", True
+
+    def emit_lifted(self, node):
+        code, lifted = self.emit(node)
+        return code if lifted else self.lift(code)
+
+
+class DualEmitter(Emitter):
+    prefix = "d_"
+    functions = DUAL_FUNCTIONS
+
+    def lift(self, code):
+        return f"vec3({code}, 0, 0)"
+
+    def negate(self, code):
+        return f"(-{code})"
+
+    def binop(self, node):
+        left, left_dual = self.emit(node.left)
+        right, right_dual = self.emit(node.right)
+        if node.op in "+-":
+            return f"({self.emit_lifted(node.left)} {node.op} {self.emit_lifted(node.right)})"
+        if node.op == "*" and not (left_dual and right_dual):
+            # scaling by a constant scales the derivatives too
+            return f"({left} * {right})"
+        if node.op == "/" and not right_dual:
+            return f"({left} / {right})"
+        name = "d_mul" if node.op == "*" else "d_div"
+        return f"{name}({self.emit_lifted(node.left)}, {self.emit_lifted(node.right)})"
+
+
+class IntervalEmitter(Emitter):
+    prefix = "i_"
+    functions = INTERVAL_FUNCTIONS
+
+    def lift(self, code):
+        return f"vec2({code})"
+
+    def negate(self, code):
+        return f"(-{code}).yx"
+
+    def binop(self, node):
+        left, left_interval = self.emit(node.left)
+        right, right_interval = self.emit(node.right)
+        if node.op == "+" or node.op == "-" and not right_interval:
+            # adding a constant moves both bounds
+            return f"({left} {node.op} {right})"
+        if node.op == "-" and not left_interval:
+            return f"({left} - {right}).yx"
+        if node.op == "*" and node.left == node.right:
+            # tighter than i_mul, which doesn't know both sides are equal
+            return f"i_sqr({left})"
+        if node.op == "*" and not (left_interval and right_interval):
+            if left_interval:
+                return f"i_scale({left}, {right})"
+            return f"i_scale({right}, {left})"
+        if node.op == "/" and not right_interval:
+            return f"i_scale({left}, 1.0/{right})"
+        name = {"-": "i_sub", "*": "i_mul", "/": "i_div"}[node.op]
+        return f"{name}({self.emit_lifted(node.left)}, {self.emit_lifted(node.right)})"
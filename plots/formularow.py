@@ -18,7 +18,8 @@
 import gi
 from gi.repository import Gtk, Gdk, Gio, GdkPixbuf, Adw, GObject
 
-from plots import formula, plots, rowcommands, colorpicker, utils
+from plots import formula, plots, rowcommands, colorpicker, utils, expression, \
+    dependencies
 from plots.data import jinja_env
 import re, math
 from enum import Enum
@@ -26,9 +27,56 @@ from enum import Enum
 # Monkey-patch Gdk.RGBA to fix equality
 Gdk.RGBA.__eq__ = Gdk.RGBA.equal
 
+
+def definitions(formulae):
+    """Return the definitions of formulae, with the function of a row that
+    is identical to an earlier row's defined as an alias of it instead."""
+    result, functions = [], {}
+    for f in formulae:
+        definition = f.definition()
+        if isinstance(f, FunctionRow) and not f.prepass:
+            # rows with the same code may still differ in their uniforms
+            key = (definition.replace(f"formula{f.id()}(", "formula(")
+                   .replace(f.constants_name(), "_c")
+                   .replace(f"_h{f.id()}_", "_h_"),
+                   tuple(f.constants()), tuple(f.invariants.values()))
+            if key in functions:
+                definition = f"#define formula{f.id()} formula{functions[key]}\n"
+            else:
+                functions[key] = f.id()
+        result.append(definition)
+    return result
+
+
+def load_sliders(formulae):
+    """Return a GLSL function which sets the Slider rows of formulae from the
+    Sliders uniform block, to be called at the start of main. Doing it in a
+    function means no local of main can hide the sliders."""
+    loads = "".join("    " + f.load() for f in formulae if isinstance(f, Slider))
+    return f"void load_sliders() {{\n{loads}}}\n"
+
+
+# Jinja checks that filters exist when a template is compiled, and the row
+# classes below load theirs as they are defined
+jinja_env.filters["definitions"] = definitions
+jinja_env.filters["load_sliders"] = load_sliders
+
+
 class RowData():
+    # Position of the row in the generated shader, assigned by
+    # Plots.update_shader. Using this rather than id(self) keeps the shader
+    # source identical when the same document is regenerated, e.g. on undo.
+    slot = 0
+    body = expr = ""
+    # whether the row is drawn by a pre-pass or analytically, see
+    # GraphArea.choose_paths
+    prepass = analytic = interval = False
+
     def id(self):
-        return id(self)
+        return self.slot
+
+    def identifiers(self):
+        return set(re.findall(r'[A-Za-z_]\w*', f"{self.body} {self.expr}"))
 
 
 class Empty(RowData):
@@ -57,10 +105,31 @@ class Variable(RowData):
         self.body = body
         self.expr = expr
 
+    # whether the value is computed on the CPU and passed as a uniform, see
+    # hoist
+    hoisted = False
+
+    def tree(self):
+        """Return the optimised tree of the value, or None if it can't be
+        parsed."""
+        if not hasattr(self, "_tree"):
+            self._tree = None
+            if not self.body.strip():
+                try:
+                    value = re.match(r'^[a-zA-Z_]\w* *=(.*)', self.expr).group(1)
+                    self._tree = expression.optimise(expression.parse(value))
+                except expression.ExpressionError:
+                    pass
+        return self._tree
+
     def definition(self):
+        if self.hoisted:
+            return f"uniform float {self.name};\n"
         return f"float {self.name} = 0.0;\n"
 
     def calculation(self):
+        if self.hoisted:
+            return ""
         return f"{self.body}\n{self.expr};\n"
 
     @staticmethod
@@ -78,7 +147,12 @@ class Slider(RowData):
         self.value = float(m.group(2))
 
     def definition(self):
-        return f"uniform float {self.name};\n"
+        # set from the Sliders uniform block by load_sliders
+        return f"float {self.name};\n"
+
+    def load(self):
+        slot = self.id()
+        return f"{self.name} = slider_values[{slot // 4}][{slot % 4}];\n"
 
     def calculation(self):
         return ""
@@ -89,9 +163,140 @@ class Slider(RowData):
         return m and m.group(1) not in ["x", "y"]
 
 
-class Formula(RowData):
+class FunctionRow(RowData):
+    """A drawn row whose expression is a function of parameters, which can
+    be drawn by sampling it at every pixel, skipping pixels where interval
+    arithmetic shows it can't be near, from a pre-pass texture, or from its
+    distance estimated with dual numbers."""
+    parameters = ()
+    # subexpressions computed on the CPU and passed as uniforms, see hoist
+    invariants = {}
+    _hoisted_tree = None
+    # the slot and tree the numbers were last lifted from, the lifted tree
+    # and the numbers, see tree
+    _lifted = (None, None, None, [])
+
+    def parsed(self):
+        """Return the optimised expression tree, or None if the expression
+        can't be parsed, e.g. because it has a sum."""
+        if not hasattr(self, "_tree"):
+            self._tree = None
+            if not self.body.strip():
+                try:
+                    self._tree = expression.optimise(
+                        expression.parse(self.expr), self.parameters)
+                except expression.ExpressionError:
+                    pass
+        return self._tree
+
+    def hoist(self, known):
+        """Move the subexpressions which only depend on the names in known
+        into invariants."""
+        self.invariants = {}
+        self._hoisted_tree = None
+        if self.parsed() is not None:
+            self._hoisted_tree, self.invariants = expression.hoist(
+                self.parsed(), known, f"_h{self.id()}_")
+
+    def tree(self):
+        """Return the expression tree as emitted, with invariants replaced
+        by their uniforms and the remaining numbers by elements of the row's
+        array of constants, so that edits which only change numbers don't
+        change the shader."""
+        tree = self._hoisted_tree if self._hoisted_tree is not None else self.parsed()
+        if tree is None:
+            return None
+        slot, base, _, _ = self._lifted
+        if slot != self.id() or base is not tree:
+            self._lifted = (self.id(), tree,
+                            *expression.lift(tree, self.constants_name()))
+        return self._lifted[2]
+
+    def constants_name(self):
+        return f"_c{self.id()}"
+
+    def constants(self):
+        """Return the values of the row's array of constants."""
+        self.tree()
+        return self._lifted[3]
+
+    def uniforms(self):
+        result = "".join(f"uniform float {name};\n" for name in self.invariants)
+        if self.constants():
+            result += f"uniform float {self.constants_name()}[{len(self.constants())}];\n"
+        return result
+
+    def function(self):
+        parameters = ", ".join(f"float {p}" for p in self.parameters)
+        body, expr = self.body, self.expr
+        if self.tree() is not None:
+            body, expr = expression.to_statements(self.tree())
+        return f"""float formula{self.id()}({parameters}) {{
+    {body}
+    return {expr};
+}}"""
+
+    def dual_expression(self):
+        """Return the expression in dual numbers, or None if it can't be
+        differentiated."""
+        try:
+            return self.tree() and expression.to_dual(self.tree(), self.parameters)
+        except expression.ExpressionError:
+            return None
+
+    def interval_expression(self):
+        """Return the expression in interval arithmetic, or None if it can't
+        be bounded."""
+        try:
+            return self.tree() and expression.to_interval(self.tree(), self.parameters)
+        except expression.ExpressionError:
+            return None
+
+    @property
+    def interval(self):
+        """Whether the samples of each pixel are skipped when the row's
+        bounds over them show none can be near the curve."""
+        return not (self.analytic or self.prepass) \
+            and self.interval_expression() is not None
+
+    def interval_function(self):
+        parameters = ", ".join(f"vec2 {p}" for p in self.parameters)
+        return f"""vec2 formula{self.id()}({parameters}) {{
+    return {self.interval_expression()};
+}}"""
+
+    def dual_function(self):
+        parameters = ", ".join(f"vec3 {p}" for p in self.parameters)
+        return f"""vec3 formula{self.id()}({parameters}) {{
+    return {self.dual_expression()};
+}}"""
+
+    def definition(self):
+        if self.analytic:
+            return self.uniforms() + self.dual_function()
+        if self.prepass:
+            return f"uniform sampler2D prepass{self.id()};\n"
+        if self.interval:
+            return self.uniforms() + self.function() + "\n" + self.interval_function()
+        return self.uniforms() + self.function()
+
+    def calculation(self):
+        if self.analytic:
+            return self.analytic_template.render(formula=self)
+        if self.prepass:
+            return self.prepass_calculation_template.render(formula=self)
+        return self.calculation_template.render(formula=self)
+
+
+class Formula(FunctionRow):
     priority = 20
     calculation_template = jinja_env.get_template("formula_calculation.glsl")
+    prepass_template = jinja_env.get_template("column.glsl")
+    prepass_calculation_template = jinja_env.get_template("column_calculation.glsl")
+    analytic_template = jinja_env.get_template("explicit_analytic_calculation.glsl")
+    parameters = ("x",)
+    # the axis the formula is evaluated along
+    axis = 0
 
     def __init__(self, owner, expr, body, rgba):
         self.owner = owner
@@ -100,24 +305,21 @@ class Formula(RowData):
         self.body = body
         self.rgba = rgba
 
-    def definition(self):
-        return f"""float formula{self.id()}(float x) {{
-    {self.body}
-    return {self.expr};
-}}"""
-
-    def calculation(self):
-        return self.calculation_template.render(formula=self)
-
     @staticmethod
     def accepts(expr):
         m = re.match(r'^(?:y *=)?(.+)', expr)
         return m and "=" not in m.group(1)
 
 
-class XFormula(RowData):
+class XFormula(FunctionRow):
     priority = 20
     calculation_template = jinja_env.get_template("x_formula_calculation.glsl")
+    prepass_template = jinja_env.get_template("column.glsl")
+    prepass_calculation_template = jinja_env.get_template("column_calculation.glsl")
+    analytic_template = jinja_env.get_template("explicit_analytic_calculation.glsl")
+    parameters = ("y",)
+    # the axis the formula is evaluated along
+    axis = 1
 
     def __init__(self, owner, expr, body, rgba):
         self.owner = owner
@@ -126,15 +328,6 @@ class XFormula(RowData):
         self.body = body
         self.rgba = rgba
 
-    def definition(self):
-        return f"""float formula{self.id()}(float y) {{
-    {self.body}
-    return {self.expr};
-}}"""
-
-    def calculation(self):
-        return self.calculation_template.render(formula=self)
-
     @staticmethod
     def accepts(expr):
         m = re.match(r'^x *=(.+)', expr)
@@ -193,9 +386,13 @@ class ThetaFormula(RowData):
         return bool(m)
 
 
-class ImplicitFormula(RowData):
+class ImplicitFormula(FunctionRow):
     priority = 20
     calculation_template = jinja_env.get_template("implicit_formula_calculation.glsl")
+    prepass_template = jinja_env.get_template("field.glsl")
+    prepass_calculation_template = jinja_env.get_template("field_calculation.glsl")
+    analytic_template = jinja_env.get_template("implicit_analytic_calculation.glsl")
+    parameters = ("x", "y")
 
     def __init__(self, owner, expr, body, rgba):
         self.owner = owner
@@ -209,14 +406,113 @@ class ImplicitFormula(RowData):
         m = re.match(r'^([^=]+)=([^=]+)$', expr)
         return bool(m)
 
-    def definition(self):
-        return f"""float formula{self.id()}(float x, float y) {{
-    {self.body}
-    return {self.expr};
-}}"""
+
+
+DRAWN_TYPES = (Formula, XFormula, RFormula, ThetaFormula, ImplicitFormula)
+
+
+
+class FusedRows():
+    """Consecutive explicit rows along the same axis and drawn by the same
+    path, whose samples are taken in a single loop."""
+    template = jinja_env.get_template("fused_calculation.glsl")
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.axis = rows[0].axis
+        self.prepass = rows[0].prepass
 
     def calculation(self):
-        return self.calculation_template.render(formula=self)
+        return self.template.render(group=self)
+
+
+def fusion_key(row):
+    if isinstance(row, (Formula, XFormula)) and not row.analytic:
+        return row.axis, row.prepass
+    return None
+
+
+def fuse(formulae):
+    """Return formulae with each run of two or more consecutive rows which
+    can share a sampling loop replaced by a FusedRows. Only consecutive rows
+    are fused, so that rows are still drawn over each other in order."""
+    result, run = [], []
+    for row in formulae + [None]:
+        key = fusion_key(row) if row is not None else None
+        if run and (key is None or key != fusion_key(run[0])):
+            result.extend([FusedRows(run)] if len(run) > 1 else run)
+            run = []
+        if key is not None:
+            run.append(row)
+        elif row is not None:
+            result.append(row)
+    return result
+
+
+jinja_env.filters["fuse"] = fuse
+
+
+def hoist(formulae):
+    """Move what only needs computing once per frame out of the shaders:
+    Variable rows which only depend on sliders and other such rows, and the
+    parts of each formula which don't depend on its parameters.
+
+    Returns a list of (uniform name, tree) pairs, to be evaluated in order
+    on the CPU.
+    """
+    known = {f.name for f in formulae if isinstance(f, Slider)}
+    invariants = []
+    for f in formulae:
+        if isinstance(f, Variable):
+            f.hoisted = f.tree() is not None and expression.invariant(f.tree(), known)
+            if f.hoisted:
+                known.add(f.name)
+                invariants.append((f.name, f.tree()))
+        elif isinstance(f, FunctionRow):
+            f.hoist(known)
+            invariants.extend(f.invariants.items())
+    return invariants
+
+
+def constants(formulae):
+    """Return a dictionary from the names of the arrays of constants of
+    formulae to their values."""
+    return {f.constants_name(): f.constants() for f in formulae
+            if isinstance(f, FunctionRow) and f.constants()}
+
+
+def with_dependencies(row, formulae):
+    """Return the Slider and Variable rows in formulae which row refers to,
+    directly or indirectly, followed by row itself. The list is enough to
+    render row on its own."""
+    named = {f.name: f for f in formulae if isinstance(f, (Slider, Variable))}
+    # a Variable refers to its own name, which mustn't make it a dependency
+    # of itself
+    needed, visited, stack = set(), {row}, [row]
+    while stack:
+        for name in stack.pop().identifiers():
+            dependency = named.get(name)
+            if dependency is not None and dependency not in visited:
+                visited.add(dependency)
+                needed.add(dependency)
+                stack.append(dependency)
+    return [f for f in formulae if f in needed] + [row]
+
+
+def dependency_graph(formulae):
+    """Return the DependencyGraph of formulae, from the names Slider and
+    Variable rows define and the identifiers in each row's code."""
+    nodes = {}
+    for f in formulae:
+        name = f.name if isinstance(f, (Slider, Variable)) else None
+        nodes[f] = dependencies.Node(name, f.identifiers() - {name})
+    return dependencies.DependencyGraph(nodes)
+
+
+def layers(formulae):
+    """Return with_dependencies(row, formulae) for each drawn row."""
+    return [with_dependencies(row, formulae)
+            for row in formulae if isinstance(row, DRAWN_TYPES)]
 
 
 class RowStatus(Enum):
@@ -237,6 +533,7 @@ class FormulaBox(Gtk.Box):
     _palette_use_next = 0
 
     delete_button = Gtk.Template.Child()
+    visible_button = Gtk.Template.Child()
     viewport = Gtk.Template.Child("editor_viewport")
     button_box = Gtk.Template.Child()
     slider = Gtk.Template.Child()
@@ -262,6 +559,7 @@ class FormulaBox(Gtk.Box):
         self.editor.connect("edit", self.edited)
         self.editor.connect("cursor_position", self.cursor_position)
         self.delete_button.connect("clicked", self.delete)
+        self.visible_button.connect("toggled", self.visibility_toggled)
         self.color_picker.connect("color-activated", self.on_color_activated)
         self.slider.connect("value-changed", self.slider_changed)
         self.slider_upper.connect("changed", self.slider_limits_changed)
@@ -296,7 +594,28 @@ class FormulaBox(Gtk.Box):
             adj.value = x - adj.page_size + 4
 
     def on_color_activated(self, widget, chooser, color):
-        self.edited(widget)
+        self.recolored()
+
+    def recolored(self, record=True):
+        """Pass the colour of the picker to the graph, which only needs the
+        colours of the rows uploading again, not a new shader."""
+        if hasattr(self.data, 'rgba'):
+            self.data.rgba = utils.rgba_to_tuple(self.color_picker.get_rgba())
+        mem = self.construct_memory()
+        if record:
+            command = rowcommands.Edit(self, self.app.rows, mem, self.old)
+            self.app.add_to_history(command)
+        self.old = mem
+        self.app.update_rows()
+
+    @property
+    def visible(self):
+        return self.visible_button.get_active()
+
+    def visibility_toggled(self, button):
+        button.set_icon_name("view-reveal-symbolic" if self.visible
+                             else "view-conceal-symbolic")
+        self.app.update_rows()
 
     def edited(self, widget, record=True):
         body, expr = self.editor.expr.to_glsl()
@@ -311,8 +630,10 @@ class FormulaBox(Gtk.Box):
 
         if hasattr(self.data, 'rgba'):
             self.color_picker.show()
+            self.visible_button.show()
         else:
             self.color_picker.hide()
+            self.visible_button.hide()
             self.name = self.data.name
 
         if isinstance(self.data, Slider):
@@ -396,7 +717,7 @@ class FormulaBox(Gtk.Box):
             self.color_picker.add_palette(Gtk.Orientation.HORIZONTAL, 9, None)
             self.color_picker.add_palette(Gtk.Orientation.HORIZONTAL, 9, new_palette)
             self.color_picker.set_rgba(new_color)
-            self.edited(None, record=False)
+            self.recolored(record=False)
 
     def style_is_dark(self):
         return Adw.StyleManager.get_default().get_dark()
@@ -0,0 +1,75 @@
+# Copyright 2022 Alexander Huntley
+
+# This file is part of Plots.
+
+# Plots is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Plots is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+import OpenGL.GL as gl
+from contextlib import contextmanager
+
+
+class Framebuffer():
+    """A texture with a framebuffer object for rendering into it."""
+    def __init__(self, internal_format=gl.GL_RGBA8, format=gl.GL_RGBA,
+                 type=gl.GL_UNSIGNED_BYTE, filter=gl.GL_LINEAR):
+        self.internal_format = internal_format
+        self.format = format
+        self.type = type
+        self.size = (0, 0)
+        self.fbo = gl.glGenFramebuffers(1)
+        self.texture = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, filter)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, filter)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+    def resize(self, width, height):
+        """Reallocate the texture if its size has changed, returning whether
+        it was reallocated (and so has undefined contents)."""
+        size = (int(width), int(height))
+        if size == self.size:
+            return False
+        self.size = size
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, self.internal_format, *size, 0,
+                        self.format, self.type, None)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        with self.bind():
+            gl.glFramebufferTexture2D(gl.GL_FRAMEBUFFER, gl.GL_COLOR_ATTACHMENT0,
+                                      gl.GL_TEXTURE_2D, self.texture, 0)
+        return True
+
+    @contextmanager
+    def bind(self):
+        """Render into the texture, restoring the previous framebuffer (which
+        for a GLArea is not framebuffer 0) and viewport afterwards."""
+        previous = gl.glGetIntegerv(gl.GL_DRAW_FRAMEBUFFER_BINDING)
+        viewport = gl.glGetIntegerv(gl.GL_VIEWPORT)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, self.fbo)
+        gl.glViewport(0, 0, *self.size)
+        try:
+            yield self
+        finally:
+            gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, previous)
+            gl.glViewport(*viewport)
+
+    def bind_texture(self, unit=0):
+        gl.glActiveTexture(gl.GL_TEXTURE0 + unit)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+
+    def delete(self):
+        gl.glDeleteFramebuffers(1, [self.fbo])
+        gl.glDeleteTextures([self.texture])
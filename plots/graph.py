@@ -23,9 +23,43 @@ from plots.data import jinja_env
 from plots.i18n import _
 import math
 import numpy as np
+from collections import OrderedDict, namedtuple
 
-from plots import utils
+from plots import utils, formularow, expression
 from plots.text import TextRenderer
+from plots.framebuffer import Framebuffer
+from plots.quality import FrameTimer, QualityController
+from plots.shaderprogram import ProgramCache, ShaderCompiler, ShaderValidator, \
+    compile_program
+
+# Uniforms that can vary between the passes of a single frame
+FrameUniforms = namedtuple("FrameUniforms", "pixel_extent major_grid minor_grid samples seed size")
+
+
+class Layer():
+    """A row drawn by its own program into a cached texture, which is only
+    redrawn when the view, the program, its colour or a slider or number it
+    uses changes."""
+    def __init__(self, program, row, names, framebuffer):
+        self.program = program
+        self.row = row
+        self.names = names
+        self.framebuffer = framebuffer
+        self.key = None
+
+
+class Prepass():
+    """A formula evaluated beforehand into a float texture, once per column
+    of the scene for explicit formulae or once per pixel for implicit ones,
+    which the programs drawing it read instead of evaluating the formula for
+    every sample of every pixel."""
+    def __init__(self, program, row, names, framebuffer):
+        self.program = program
+        self.row = row
+        self.names = names
+        self.framebuffer = framebuffer
+        self.key = None
+
 
 class GraphArea(Gtk.GLArea):
     __gtype_name__ = "GraphArea"
@@ -34,6 +68,23 @@ class GraphArea(Gtk.GLArea):
     ZOOM_BUTTON_FACTOR = 0.3
     ZOOM_MINIMUM = 5e-34
     ZOOM_MAXIMUM = 1e+38
+    # fraction of the full resolution rendered while panning or zooming
+    INTERACTION_SCALE = 0.5
+    # milliseconds without input before returning to full resolution
+    INTERACTION_TIMEOUT = 200
+    # in progressive rendering, the samples per pixel of each frame and the
+    # number of frames accumulated before the image is considered finished
+    PROGRESSIVE_SAMPLES = 4
+    PROGRESSIVE_FRAMES = 64
+    # grid labels laid out and kept for reuse, see label
+    LABEL_CACHE_SIZE = 256
+    # most formulae evaluated by a pre-pass, each needing its own texture unit
+    MAX_PREPASSES = 8
+    # size of the Rows and Sliders uniform blocks in common.glsl, which are
+    # indexed by slot, and their binding points
+    MAX_ROWS = 1024
+    ROWS_BINDING = 0
+    SLIDERS_BINDING = 1
 
     def __init__(self):
         super().__init__()
@@ -41,7 +92,14 @@ class GraphArea(Gtk.GLArea):
         self._translation = np.array([0, 0], 'f')
         self.vertex_template = jinja_env.get_template('vertex.glsl')
         self.fragment_template = jinja_env.get_template('fragment.glsl')
+        self.composite_template = jinja_env.get_template('composite.glsl')
+        self.reproject_template = jinja_env.get_template('reproject.glsl')
         self.export_target = None
+        self.interacting = False
+        self.interaction_source = None
+        # kept across gestures, so each one starts from the samples and scale
+        # the document could afford last time
+        self.quality = QualityController()
         self.connect("render", self.gl_render)
         self.connect("realize", self.gl_realize)
         self.app = None
@@ -58,6 +116,26 @@ class GraphArea(Gtk.GLArea):
         self.add_controller(scroll_ctl)
 
         self.vertex_shader = None
+        self.shader = None
+        self.program = None
+        self.layers = None
+        self.prepasses = []
+        # framebuffers of layers and pre-passes no longer in use
+        self.layer_framebuffers = []
+        self.prepass_framebuffers = []
+        self.invariants = []
+        self.invariant_values = {}
+        self.constants = {}
+        # incremented whenever a build is ready, since what is passed as
+        # uniforms rather than in the source can change without the programs
+        self.generation = 0
+        self.row_colors = np.zeros((self.MAX_ROWS, 4), 'f')
+        self.rows_changed = False
+        self.slider_values = np.zeros(self.MAX_ROWS, 'f')
+        self.sliders = {}
+        self.program_cache = ProgramCache()
+        self.validator = ShaderValidator()
+        self.compiler = ShaderCompiler(self, self.program_cache, self.validator)
 
     @property
     def target_scale(self):
@@ -99,7 +177,7 @@ class GraphArea(Gtk.GLArea):
     def graph_to_device(self, graph_pos):
         normalised = (graph_pos + self.translation)/self.scale
         gl_pos = normalised / self.viewport * self.viewport[0]
-        gl_pos[1] *= -1
+        gl_pos[..., 1] *= -1
         return (gl_pos/2 + 0.5) * self.viewport
 
     def device_to_graph(self, pixel):
@@ -128,6 +206,11 @@ class GraphArea(Gtk.GLArea):
 
         self.vertex_shader = shaders.compileShader(
             self.vertex_template.render(), gl.GL_VERTEX_SHADER)
+        self.composite_shader = compile_program(
+            self.vertex_shader, self.composite_template.render())
+        self.reproject_shader = compile_program(
+            self.vertex_shader, self.reproject_template.render())
+        self.compiler.realize()
         self.app.update_shader()
 
         self.vbo = vbo.VBO(np.array([
@@ -148,13 +231,37 @@ class GraphArea(Gtk.GLArea):
         self.vbo.unbind()
         gl.glBindVertexArray(0)
 
+        self.rows_buffer = gl.glGenBuffers(1)
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.rows_buffer)
+        gl.glBufferData(gl.GL_UNIFORM_BUFFER, self.row_colors.nbytes,
+                        self.row_colors, gl.GL_DYNAMIC_DRAW)
+        self.sliders_buffer = gl.glGenBuffers(1)
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.sliders_buffer)
+        gl.glBufferData(gl.GL_UNIFORM_BUFFER, self.slider_values.nbytes,
+                        self.slider_values, gl.GL_DYNAMIC_DRAW)
+        gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, 0)
+
+        self.scene_framebuffer = Framebuffer()
+        self.accumulation_framebuffer = Framebuffer(
+            internal_format=gl.GL_RGBA16F, type=gl.GL_FLOAT)
+        self.accumulation_key = None
+        self.accumulated = 0
+        self.frame_timer = FrameTimer()
+        self.reprojection_framebuffer = Framebuffer()
+        self.reprojection_key = None
+        self.reprojection_view = None
         self.text_renderer = TextRenderer(scale_factor=area.get_scale_factor())
+        self.labels = OrderedDict()
+        self.label_state = None
 
     def gl_render(self, area, context):
         area.make_current()
         w = area.get_allocated_width() * area.get_scale_factor()
         h = area.get_allocated_height() * area.get_scale_factor()
         self.viewport = np.array([w, h], 'f')
+        # the glyphs are distance fields, so moving to a display with another
+        # scale factor only needs the labels laying out again
+        self.text_renderer.scale_factor = area.get_scale_factor()
         self.render()
 
         if self.export_target:
@@ -176,57 +283,469 @@ class GraphArea(Gtk.GLArea):
 
         gl.glViewport(0, 0, w, h)
 
-        gl.glClearColor(0, 0, 1, 0)
+        gl.glClearColor(*self.bg_color, 1)
         gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+        if self.shader is None:
+            # the first program is still compiling
+            return
+        self.upload_sliders()
+        self.invariant_values = self.evaluate_invariants()
+        self.upload_rows()
         gl.glEnable(gl.GL_BLEND)
         gl.glEnable(gl.GL_DEPTH_TEST)
         gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
 
         major_grid, minor_grid = self.major_grid(pixel_extent[0])
-        shaders.glUseProgram(self.shader)
+        size = np.maximum(np.round(self.viewport*self.render_scale()), 1)
+        frame = FrameUniforms(pixel_extent, major_grid, minor_grid,
+                              self.samples(), 0, size)
+        if self.reprojectable():
+            self.draw_reprojected(frame)
+        elif self.progressive():
+            self.accumulate(size, frame)
+            self.draw_texture(self.accumulation_framebuffer, self.viewport)
+        else:
+            # only frames of the whole scene at the chosen samples and scale
+            # are timed, since those are what the quality controller adjusts
+            with self.frame_timer.time():
+                if (size != self.viewport).any():
+                    # render at a lower resolution, then scale up to fill the widget
+                    self.scene_framebuffer.resize(*size)
+                    with self.scene_framebuffer.bind():
+                        self.draw_scene(size, frame)
+                    self.draw_texture(self.scene_framebuffer, self.viewport)
+                else:
+                    self.draw_scene(self.viewport, frame)
+        for elapsed in self.frame_timer.results():
+            self.quality.update(elapsed, self.app.prefs["rendering"]["frame_budget"])
+        if not self.interacting:
+            self.capture()
+
+        if major_grid <= 0:
+            return
+        with self.text_renderer.render(w, h) as r:
+            # the multiples of major_grid in view along each axis
+            low = np.floor(self.device_to_graph(np.array([0, h]))/major_grid)
+            high = np.ceil(self.device_to_graph(np.array([w, 0]))/major_grid)
+            pad = 4
+            ticks = np.arange(low[0], high[0] + 1)
+            ticks = ticks[ticks != 0]
+            pos = self.graph_to_device(
+                np.stack([ticks*major_grid, np.zeros_like(ticks)], axis=-1))
+            pos[:, 1] = np.clip(pos[:, 1] + pad, pad, self.viewport[1] - r.top_bearing - pad)
+            for tick, p in zip(ticks, pos):
+                quads, _ = self.label(0, tick, major_grid)
+                r.render_quads(quads, p, text_color=self.fg_color, bg_color=self.bg_color)
+            ticks = np.arange(low[1], high[1] + 1)
+            ticks = ticks[ticks != 0]
+            pos = self.graph_to_device(
+                np.stack([np.zeros_like(ticks), ticks*major_grid], axis=-1))
+            pos[:, 0] -= pad
+            for tick, p in zip(ticks, pos):
+                quads, width = self.label(1, tick, major_grid)
+                p[0] = np.clip(p[0], width + pad, self.viewport[0] - pad)
+                r.render_quads(quads, p, text_color=self.fg_color, bg_color=self.bg_color)
+            r.render_text("0", self.graph_to_device(np.zeros(2)) + np.array([-pad, pad]),
+                          valign='top', halign='right', text_color=self.fg_color, bg_color=self.bg_color)
+
+
+    def label(self, axis, tick, major_grid):
+        """Return the quads of the label of the tick-th major grid line along
+        axis, aligned to where it meets the other axis, and its width.
+        Labels are kept in a small LRU cache, so panning only lays out the
+        labels which come into view."""
+        r = self.text_renderer
+        if self.label_state != (r.evictions, r.scale):
+            # the glyphs the labels were laid out with may have moved, or
+            # be drawn at another size
+            self.labels.clear()
+            self.label_state = (r.evictions, r.scale)
+        key = (axis, tick, major_grid)
+        label = self.labels.get(key)
+        if label is None:
+            text = ("%g" % (tick*major_grid)).replace("-", "\N{MINUS SIGN}")
+            if axis == 0:
+                quads = r.aligned_layout(text, halign='center', valign='top')
+            else:
+                quads = r.aligned_layout(text, halign='right', valign='center')
+            label = self.labels[key] = (quads, r.width_of(text))
+            while len(self.labels) > self.LABEL_CACHE_SIZE:
+                self.labels.popitem(last=False)
+        else:
+            self.labels.move_to_end(key)
+        return label
+
+    def auto_quality(self):
+        return self.app.prefs["rendering"]["auto_quality"] and not self.export_target
+
+    def samples(self):
+        if self.auto_quality():
+            return self.quality.samples
+        return self.app.prefs["rendering"]["samples"]
+
+    def render_scale(self):
+        if self.export_target:
+            return 1
+        scale = self.app.prefs["rendering"]["render_scale"]
+        if self.auto_quality():
+            scale *= self.quality.scale
+        elif self.interacting:
+            scale *= self.INTERACTION_SCALE
+        return scale
+
+    def progressive(self):
+        return self.app.prefs["rendering"]["progressive"] \
+            and not self.interacting and not self.export_target
+
+    def content_key(self, size):
+        """Everything other than the view and the per-frame uniforms which
+        affects the rendered image."""
+        programs = [self.shader] + [layer.program for layer in self.layers or []]
+        return (*size, *programs, self.generation, *self.fg_color, *self.bg_color,
+                *(value for key, value in sorted(self.app.prefs["rendering"].items())),
+                self.slider_values.tobytes())
+
+    def view_key(self, size):
+        return (*self.content_key(size), *self.translation, self.scale)
+
+    def capture(self):
+        """Keep a copy of the frame just drawn, for reprojection while the
+        view is moved."""
+        w, h = self.viewport.astype(int)
+        self.reprojection_framebuffer.resize(w, h)
+        target = gl.glGetIntegerv(gl.GL_DRAW_FRAMEBUFFER_BINDING)
+        gl.glBindFramebuffer(gl.GL_READ_FRAMEBUFFER, target)
+        gl.glBindFramebuffer(gl.GL_DRAW_FRAMEBUFFER, self.reprojection_framebuffer.fbo)
+        gl.glBlitFramebuffer(0, 0, w, h, 0, 0, w, h,
+                             gl.GL_COLOR_BUFFER_BIT, gl.GL_NEAREST)
+        gl.glBindFramebuffer(gl.GL_FRAMEBUFFER, target)
+        self.reprojection_key = self.content_key(self.viewport)
+        self.reprojection_view = (self.translation.copy(), self.scale)
+
+    def reprojectable(self):
+        if not self.interacting or self.export_target \
+           or self.reprojection_key != self.content_key(self.viewport):
+            return False
+        # too much zoom and the reprojected image is too blurry or too small
+        # to be worth it
+        return 0.5 <= self.reprojection_view[1]/self.scale <= 2
+
+    def exposed_rects(self):
+        """Return the (x, y, width, height) rectangles of the widget, in window
+        coordinates, which the captured frame doesn't cover at the current
+        translation and scale."""
+        cached_translation, cached_scale = self.reprojection_view
+        k = cached_scale/self.scale
+        offset = (self.translation - cached_translation)*self.viewport[0]/(2*self.scale)
+        centre = self.viewport/2
+        lo = np.clip(np.floor(centre*(1 - k) + offset), 0, self.viewport).astype(int)
+        hi = np.clip(np.ceil(centre*(1 + k) + offset), 0, self.viewport).astype(int)
+        w, h = self.viewport.astype(int)
+        rects = [(0, 0, lo[0], h), (hi[0], 0, w - hi[0], h),
+                 (lo[0], 0, hi[0] - lo[0], lo[1]), (lo[0], hi[1], hi[0] - lo[0], h - hi[1])]
+        return [r for r in rects if r[2] > 0 and r[3] > 0]
+
+    def draw_reprojected(self, frame):
+        """Draw the captured frame moved to the current view, and render only
+        the strips it leaves uncovered."""
+        cached_translation, cached_scale = self.reprojection_view
+        frame = frame._replace(size=self.viewport)
+        rects = self.exposed_rects()
+        self.draw_prepasses(frame, rects)
+        self.program = self.reproject_shader
+        shaders.glUseProgram(self.reproject_shader)
+        self.reprojection_framebuffer.bind_texture(0)
+        gl.glUniform1i(self.uniform("image"), 0)
         gl.glUniform2f(self.uniform("viewport"), *self.viewport)
         gl.glUniform2f(self.uniform("translation"), *self.translation)
-        gl.glUniform2f(self.uniform("pixel_extent"), *pixel_extent)
         gl.glUniform1f(self.uniform("scale"), self.scale)
-        gl.glUniform1f(self.uniform("major_grid"), major_grid)
-        gl.glUniform1f(self.uniform("minor_grid"), minor_grid)
-        gl.glUniform1f(self.uniform("samples"), self.app.prefs["rendering"]["samples"])
+        gl.glUniform2f(self.uniform("cached_translation"), *cached_translation)
+        gl.glUniform1f(self.uniform("cached_scale"), cached_scale)
+        self.draw_quad()
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        gl.glEnable(gl.GL_SCISSOR_TEST)
+        for rect in rects:
+            gl.glScissor(*rect)
+            self.draw_direct(frame)
+        gl.glDisable(gl.GL_SCISSOR_TEST)
+
+    def draw_direct(self, frame):
+        """Draw the scene into the current framebuffer without using the
+        layer cache, e.g. when only a small part of it is needed."""
+        self.draw_program(self.shader, frame)
+        if self.layers is not None:
+            gl.glBlendFunc(gl.GL_ONE, gl.GL_ONE_MINUS_SRC_ALPHA)
+            for layer in self.layers:
+                self.draw_program(layer.program, frame)
+            gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+
+    def accumulate(self, size, frame):
+        """Render a frame with a few jittered samples per pixel and blend it
+        into the running average in accumulation_framebuffer, starting again
+        whenever the view changes."""
+        key = self.view_key(size)
+        if self.accumulation_framebuffer.resize(*size) or key != self.accumulation_key:
+            self.accumulation_key = key
+            self.accumulated = 0
+        if self.accumulated >= self.PROGRESSIVE_FRAMES:
+            return
+        frame = frame._replace(samples=self.PROGRESSIVE_SAMPLES,
+                               seed=self.accumulated + 1)
+        self.scene_framebuffer.resize(*size)
+        with self.scene_framebuffer.bind():
+            self.draw_scene(size, frame)
+        with self.accumulation_framebuffer.bind():
+            gl.glBlendColor(0, 0, 0, 1/(self.accumulated + 1))
+            gl.glBlendFunc(gl.GL_CONSTANT_ALPHA, gl.GL_ONE_MINUS_CONSTANT_ALPHA)
+            self.draw_texture(self.scene_framebuffer, size)
+            gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+        self.accumulated += 1
+        if self.accumulated < self.PROGRESSIVE_FRAMES:
+            self.queue_draw()
+
+    def draw_scene(self, size, frame):
+        """Draw the grid and formulae into the current framebuffer, which is
+        size pixels. frame.pixel_extent is always that of the widget, so lines
+        keep the same thickness whatever the resolution."""
+        self.draw_prepasses(frame)
+        self.draw_program(self.shader, frame)
+        if self.layers is not None:
+            self.draw_layers(size, frame)
+
+    def draw_program(self, program, frame):
+        self.program = program
+        shaders.glUseProgram(program)
+        gl.glUniform2f(self.uniform("viewport"), *self.viewport)
+        gl.glUniform2f(self.uniform("translation"), *self.translation)
+        gl.glUniform2f(self.uniform("pixel_extent"), *frame.pixel_extent)
+        gl.glUniform2f(self.uniform("resolution"), *frame.size)
+        gl.glUniform1f(self.uniform("scale"), self.scale)
+        gl.glUniform1f(self.uniform("major_grid"), frame.major_grid)
+        gl.glUniform1f(self.uniform("minor_grid"), frame.minor_grid)
+        gl.glUniform1f(self.uniform("samples"), frame.samples)
+        gl.glUniform1f(self.uniform("seed"), frame.seed)
         gl.glUniform1f(self.uniform("line_thickness"), self.app.prefs["rendering"]["line_thickness"])
         gl.glUniform3f(self.uniform("fg_color"), *self.fg_color)
         gl.glUniform3f(self.uniform("bg_color"), *self.bg_color)
+        for name, value in self.invariant_values.items():
+            gl.glUniform1f(self.uniform(name), value)
+        for name, values in self.constants.items():
+            gl.glUniform1fv(self.uniform(name), len(values), values)
+        gl.glUniform1f(self.uniform("field_border"), self.field_border(frame))
+        for unit, prepass in enumerate(self.prepasses, 1):
+            location = self.uniform(f"prepass{prepass.row.id()}")
+            if location != -1:
+                prepass.framebuffer.bind_texture(unit)
+                gl.glUniform1i(location, unit)
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        self.draw_quad()
+
+    def evaluate_invariants(self):
+        """Compute the values hoisted out of the shaders, for the current
+        values of the sliders."""
+        values = dict(self.sliders)
+        result = {}
+        for name, tree in self.invariants:
+            values[name] = result[name] = expression.evaluate(tree, values)
+        return result
+
+    def update_rows(self, formulae):
+        """Set the colour and visibility of each drawn row of formulae, for
+        the next frame. Rows which aren't drawn have no slot."""
+        self.row_colors[:] = 0
+        for f in formulae:
+            slot = f.id()
+            if isinstance(f, formularow.DRAWN_TYPES) and slot is not None \
+                    and slot < self.MAX_ROWS:
+                self.row_colors[slot] = (*f.rgba[:3], f.owner.visible)
+        self.rows_changed = True
+        self.generation += 1
+        self.queue_draw()
+
+    def upload_sliders(self):
+        """Read the values of the sliders, and upload them to the Sliders
+        uniform block if they have changed. Only sliders with a slot are
+        read: of several with the same name, the others are marked bad by
+        Plots.update_shader and left without one."""
+        self.sliders = {}
+        values = np.zeros_like(self.slider_values)
         for slider in self.app.slider_rows:
-            gl.glUniform1f(self.uniform(slider.name), slider.value)
+            slot = slider.get_data().id()
+            if slot is not None and slot < self.MAX_ROWS:
+                self.sliders[slider.name] = values[slot] = slider.value
+        if (values != self.slider_values).any():
+            self.slider_values = values
+            gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.sliders_buffer)
+            gl.glBufferSubData(gl.GL_UNIFORM_BUFFER, 0, values.nbytes, values)
+            gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, 0)
+        gl.glBindBufferBase(gl.GL_UNIFORM_BUFFER, self.SLIDERS_BINDING,
+                            self.sliders_buffer)
+
+    def upload_rows(self):
+        if self.rows_changed:
+            gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, self.rows_buffer)
+            gl.glBufferSubData(gl.GL_UNIFORM_BUFFER, 0, self.row_colors.nbytes,
+                               self.row_colors)
+            gl.glBindBuffer(gl.GL_UNIFORM_BUFFER, 0)
+            self.rows_changed = False
+        gl.glBindBufferBase(gl.GL_UNIFORM_BUFFER, self.ROWS_BINDING, self.rows_buffer)
+
+    def draw_quad(self):
         gl.glBindVertexArray(self.vao)
         gl.glDrawArrays(gl.GL_TRIANGLES, 0, 18)
         gl.glBindVertexArray(0)
 
-        if major_grid <= 0:
+    def draw_texture(self, framebuffer, size):
+        """Draw the texture of framebuffer over the whole target, which is
+        size pixels."""
+        self.program = self.composite_shader
+        shaders.glUseProgram(self.composite_shader)
+        framebuffer.bind_texture(0)
+        gl.glUniform1i(self.uniform("image"), 0)
+        gl.glUniform2f(self.uniform("viewport"), *size)
+        self.draw_quad()
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+
+    def draw_layers(self, size, frame):
+        view = (*size, *self.translation, self.scale, frame.samples, frame.seed,
+                self.app.prefs["rendering"]["line_thickness"], *self.fg_color, *self.bg_color)
+        gl.glDisable(gl.GL_BLEND)
+        gl.glClearColor(0, 0, 0, 0)
+        layers = [layer for layer in self.layers if layer.row.owner.visible]
+        for layer in layers:
+            layer.framebuffer.resize(*size)
+            key = (layer.program, *view, layer.row.rgba, *self.uniform_key(layer.program),
+                   *(self.sliders.get(name) for name in layer.names))
+            if key != layer.key:
+                with layer.framebuffer.bind():
+                    gl.glClear(gl.GL_COLOR_BUFFER_BIT)
+                    self.draw_program(layer.program, frame)
+                layer.key = key
+        gl.glEnable(gl.GL_BLEND)
+        # layers hold premultiplied colours
+        gl.glBlendFunc(gl.GL_ONE, gl.GL_ONE_MINUS_SRC_ALPHA)
+        for layer in layers:
+            self.draw_texture(layer.framebuffer, size)
+        gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
+
+    def field_border(self, frame):
+        """Return the width, in pixels, of the margin around the scene in which
+        implicit formulae are also evaluated: enough to cover the sampling
+        window of field_calculation.glsl at the edge of the scene."""
+        half_samples = round(math.sqrt(frame.samples)/2)
+        step = 12*self.app.prefs["rendering"]["line_thickness"]/frame.samples
+        return math.ceil((half_samples + 2)*step) + 1
+
+    def prepass_size(self, row, frame):
+        if isinstance(row, formularow.ImplicitFormula):
+            border = self.field_border(frame)
+            return [int(n) + 2*border for n in frame.size]
+        return int(frame.size[row.axis]), frame.samples + 1
+
+    def prepass_rect(self, row, rect, frame):
+        """Return the rectangle (x, y, width, height) of the texture of row's
+        pre-pass which the pixels of the scene in rect read."""
+        x, y, w, h = rect
+        if isinstance(row, formularow.ImplicitFormula):
+            # the texture has a margin, and the pixels sample it up to the
+            # margin's width away
+            border = self.field_border(frame)
+            return x, y, w + 2*border, h + 2*border
+        if row.axis == 0:
+            return x, 0, w, frame.samples + 1
+        return y, 0, h, frame.samples + 1
+
+    def draw_prepasses(self, frame, rects=None):
+        """Evaluate the formulae with a pre-pass for a scene of frame.size
+        pixels, unless nothing they depend on has changed.
+
+        If rects is given, only the parts of the textures read by the pixels
+        in those rectangles of the scene are evaluated.
+        """
+        if not self.prepasses:
             return
-        with self.text_renderer.render(w, h) as r:
-            low = major_grid * np.floor(
-                self.device_to_graph(np.array([0, h]))/major_grid)
-            high = major_grid * np.ceil(
-                self.device_to_graph(np.array([w, 0]))/major_grid)
-            n = (high - low)/major_grid
-            pad = 4
-            for i in range(round(n[0])+1):
-                x = low[0] + i*major_grid
-                pos = self.graph_to_device(np.array([x, 0]))
-                pos[1] = np.clip(pos[1] + pad, pad, self.viewport[1] - r.top_bearing - pad)
-                if x:
-                    r.render_text("%g" % x, pos, valign='top', halign='center',
-                                  text_color=self.fg_color, bg_color=self.bg_color)
-            for j in range(round(n[1])+1):
-                y = low[1] + j*major_grid
-                label = "%g" % y
-                pos = self.graph_to_device(np.array([0, y]))
-                pos[0] = np.clip(pos[0] - pad, r.width_of(label) + pad, self.viewport[0] - pad)
-                if y:
-                    r.render_text(label, pos, valign='center', halign='right',
-                                  text_color=self.fg_color, bg_color=self.bg_color)
-            r.render_text("0", self.graph_to_device(np.zeros(2)) + np.array([-pad, pad]),
-                          valign='top', halign='right', text_color=self.fg_color, bg_color=self.bg_color)
+        view = (*self.viewport, *self.translation, self.scale, frame.samples,
+                frame.seed, self.app.prefs["rendering"]["line_thickness"])
+        gl.glDisable(gl.GL_BLEND)
+        for prepass in self.prepasses:
+            if not prepass.row.owner.visible:
+                continue
+            size = self.prepass_size(prepass.row, frame)
+            prepass.framebuffer.resize(*size)
+            key = (prepass.program, *size, *view, *self.uniform_key(prepass.program),
+                   *(self.sliders.get(name) for name in prepass.names))
+            if rects is not None:
+                gl.glEnable(gl.GL_SCISSOR_TEST)
+                with prepass.framebuffer.bind():
+                    for rect in rects:
+                        gl.glScissor(*self.prepass_rect(prepass.row, rect, frame))
+                        self.draw_program(prepass.program, frame)
+                gl.glDisable(gl.GL_SCISSOR_TEST)
+                # the rest of the texture is out of date
+                prepass.key = None
+            elif key != prepass.key:
+                with prepass.framebuffer.bind():
+                    self.draw_program(prepass.program, frame)
+                prepass.key = key
+        gl.glEnable(gl.GL_BLEND)
 
+    def choose_paths(self, formulae):
+        """Mark which formulae are to be drawn analytically and which by a
+        pre-pass, and return the latter. The rest are sampled at every pixel
+        as before. Plots.update_shader does this before validating rows, so
+        that each row is checked in the variant it is built in."""
+        analytic = self.app.prefs["rendering"]["analytic"]
+        prepassed = []
+        for f in formulae:
+            if not isinstance(f, formularow.FunctionRow):
+                continue
+            f.analytic = analytic and f.dual_expression() is not None
+            f.prepass = not f.analytic and len(prepassed) < self.MAX_PREPASSES
+            if f.prepass:
+                prepassed.append(f)
+        return prepassed
+
+    def uniform_key(self, program):
+        """Return the values of the invariants and constants which program
+        uses, which can change without the program changing."""
+        return (*(value for name, value in self.invariant_values.items()
+                  if name in program.uniforms),
+                *(values.tobytes() for name, values in self.constants.items()
+                  if name in program.uniforms))
+
+    def set_prepasses(self, programs, rows, formulae):
+        """Set up a pre-pass for each of rows. A pre-pass whose program is
+        unchanged keeps its texture and key, so it isn't evaluated again
+        unless something it uses has changed."""
+        old = {prepass.program: prepass for prepass in self.prepasses}
+        self.prepasses = []
+        for program, row in zip(programs, rows):
+            names = [f.name for f in formularow.with_dependencies(row, formulae)[:-1]]
+            prepass = old.pop(program, None)
+            if prepass is None:
+                framebuffer = self.prepass_framebuffers.pop() if self.prepass_framebuffers \
+                    else Framebuffer(internal_format=gl.GL_RGBA32F, type=gl.GL_FLOAT)
+                prepass = Prepass(program, row, names, framebuffer)
+            prepass.row, prepass.names = row, names
+            self.prepasses.append(prepass)
+        self.prepass_framebuffers.extend(prepass.framebuffer for prepass in old.values())
+
+    def set_layers(self, programs, layers):
+        """Set up a layer for each list of formulae in layers, ending with the
+        row it draws. Like pre-passes, layers whose program is unchanged keep
+        their texture, so editing one row only redraws that row's layer."""
+        old = {layer.program: layer for layer in self.layers or []}
+        self.layers = None if layers is None else []
+        for program, formulae in zip(programs, layers or []):
+            names = [f.name for f in formulae[:-1]]
+            layer = old.pop(program, None)
+            if layer is None:
+                framebuffer = self.layer_framebuffers.pop() if self.layer_framebuffers \
+                    else Framebuffer()
+                layer = Layer(program, formulae[-1], names, framebuffer)
+            layer.row, layer.names = formulae[-1], names
+            self.layers.append(layer)
+        self.layer_framebuffers.extend(layer.framebuffer for layer in old.values())
 
     def style_cb(self, widget):
         ctx = self.get_style_context()
@@ -234,11 +753,27 @@ class GraphArea(Gtk.GLArea):
         self.bg_color = utils.rgba_to_tuple(ctx.lookup_color("window_bg_color").color)[:3]
 
     def uniform(self, name):
-        return gl.glGetUniformLocation(self.shader, name)
+        return self.program.uniform(name)
+
+    def interaction(self):
+        """Note that the view is being moved, so frames may be rendered at a
+        lower resolution until input has stopped for a moment."""
+        self.interacting = True
+        if self.interaction_source is not None:
+            GLib.source_remove(self.interaction_source)
+        self.interaction_source = GLib.timeout_add(
+            self.INTERACTION_TIMEOUT, self.interaction_timeout_cb)
+
+    def interaction_timeout_cb(self):
+        self.interacting = False
+        self.interaction_source = None
+        self.queue_draw()
+        return GLib.SOURCE_REMOVE
 
     def drag_update(self, gesture, dx, dy):
         dr = 2*np.array([dx, -dy], 'f')/self.viewport[0]*self.get_scale_factor()
         self.translation = self.init_translation + dr*self.scale
+        self.interaction()
         self.queue_draw()
 
     def drag_begin(self, gesture, start_x, start_y):
@@ -263,6 +798,7 @@ class GraphArea(Gtk.GLArea):
             self.scale = self.target_scale
             if translate_to is not None:
                 self.translation = translate_to
+        self.interaction()
         self.queue_draw()
 
     def scroll_zoom(self, ctl, dx, dy):
@@ -284,11 +820,79 @@ class GraphArea(Gtk.GLArea):
         if self.app.zoom_reset_revealer.get_reveal_child() != desired:
             self.app.zoom_reset_revealer.set_reveal_child(desired)
 
-    def update_fragment_shader(self, formulae):
+    def validate(self, rows, formulae, on_ready):
+        """Check whether each of rows builds on its own, with the rows of
+        formulae it depends on, to vet rows individually before building the
+        full program. Each row is checked in the fragment shader and, if it
+        has one, the pre-pass it will be built into.
+
+        Like update_fragment_shader this returns immediately, and calls
+        on_ready with whether each row built, cached by source.
+        """
+        if not self.vertex_shader:
+            on_ready([True]*len(rows))
+            return
+        self.make_current()
+        sources = []
+        for row in rows:
+            needed = formularow.with_dependencies(row, formulae)
+            row_sources = [self.fragment_template.render(formulae=needed)]
+            if row.prepass:
+                row_sources.append(
+                    row.prepass_template.render(formulae=needed, formula=row))
+            sources.append(row_sources)
+
+        def ready(results):
+            ok, start = [], 0
+            for row_sources in sources:
+                ok.append(all(results[start:start + len(row_sources)]))
+                start += len(row_sources)
+            on_ready(ok)
+        self.compiler.validate(
+            self.vertex_shader, [s for row_sources in sources for s in row_sources], ready)
+
+    def update_fragment_shader(self, formulae, on_ready, on_error):
+        """Start building a program for formulae.
+
+        Returns immediately; the current program stays in use until the new
+        one has linked, then on_ready() is called. If it fails to build,
+        on_error(error) is called with the RuntimeError instead.
+        """
         if self.vertex_shader:
             self.make_current()
-            fragment_shader = shaders.compileShader(
-                self.fragment_template.render(formulae=formulae),
-                gl.GL_FRAGMENT_SHADER)
-            self.shader = shaders.compileProgram(self.vertex_shader, fragment_shader)
-            self.queue_draw()
+            invariants = formularow.hoist(formulae)
+            constants = {name: np.array(values, dtype=np.float32) for name, values
+                         in formularow.constants(formulae).items()}
+            # the paths were chosen, and the rows checked in them, by
+            # Plots.update_shader
+            prepassed = [f for f in formulae if f.prepass]
+            if self.app.prefs["rendering"]["layered"]:
+                # the grid is drawn on its own, with each drawn row composited
+                # over it from a separately compiled program
+                layers = formularow.layers(formulae)
+                sources = [self.fragment_template.render(formulae=[])] + [
+                    self.fragment_template.render(formulae=layer, layer=True)
+                    for layer in layers]
+            else:
+                layers = None
+                sources = [self.fragment_template.render(formulae=formulae)]
+            count = len(sources)
+            sources += [
+                row.prepass_template.render(
+                    formulae=formularow.with_dependencies(row, formulae), formula=row)
+                for row in prepassed]
+
+            def ready(programs):
+                for program in programs:
+                    program.bind_block("Rows", self.ROWS_BINDING)
+                    program.bind_block("Sliders", self.SLIDERS_BINDING)
+                self.shader, *layer_programs = programs[:count]
+                self.set_layers(layer_programs, layers)
+                self.set_prepasses(programs[count:], prepassed, formulae)
+                self.invariants = invariants
+                self.constants = constants
+                self.update_rows(formulae)
+                on_ready()
+            self.compiler.submit(self.vertex_shader, sources, ready, on_error)
+        else:
+            on_ready()
@@ -33,6 +33,7 @@ class Plots(Adw.Application):
         super().__init__(application_id="com.github.alexhuntley.Plots")
         self.rows = []
         self.slider_rows = []
+        self.dependencies = formularow.dependency_graph([])
         self.history = []
         self.history_position = 0  # index of the last undone command / next in line for redo
         self.overlay_source = None
@@ -214,39 +215,111 @@ class Plots(Adw.Application):
         return False
 
     def update_shader(self):
-        good, bad, unknown = [], [], []
         self.slider_rows.clear()
+        formulae = []
         for r in self.rows:
             data = r.get_data()
-            if r.row_status == formularow.RowStatus.GOOD:
-                good.append(data)
-            elif r.row_status == formularow.RowStatus.BAD:
-                bad.append(data)
-            elif r.row_status == formularow.RowStatus.UNKNOWN:
-                unknown.append(data)
+            formulae.append(data)
             if isinstance(data, formularow.Slider):
                 self.slider_rows.append(r)
-
-        def attempt(formulae):
-            formulae.sort(key=lambda x: x.priority, reverse=True)
-            self.gl_area.update_fragment_shader(formulae)
+        # rows come after the rows they depend on, and otherwise by priority
+        self.dependencies = formularow.dependency_graph(formulae)
+        formulae, cyclic = self.dependencies.order(key=lambda x: -x.priority)
+        for f in cyclic:
+            f.owner.row_status = formularow.RowStatus.BAD
+
+        candidates, defined = [], set()
+        for f in formulae:
+            name = self.dependencies.nodes[f].name
+            if name is not None and name in defined:
+                # only the first definition of a name is used
+                f.owner.row_status = formularow.RowStatus.BAD
+            if f.owner.row_status is not formularow.RowStatus.BAD:
+                candidates.append(f)
+                defined.add(name)
+        # Only rows which may be drawn are given a slot, so a row left out
+        # can't keep a stale one, and with it the colour or slider value of
+        # another row, see GraphArea.update_rows and upload_sliders
+        for f in formulae + cyclic:
+            f.slot = None
+        for slot, f in enumerate(candidates):
+            f.slot = slot
+
+        # Rows are checked in the way they will be drawn, so a row whose
+        # path changes has to be checked again
+        paths = {f: (f.analytic, f.prepass) for f in candidates}
+        formularow.hoist(candidates)
+        self.gl_area.choose_paths(candidates)
+        for f in candidates:
+            if (f.analytic, f.prepass) != paths[f]:
+                f.owner.row_status = formularow.RowStatus.UNKNOWN
+
+        # Check each row on its own against the rows it depends on, so a bad
+        # row is left out before the whole document is compiled. Rows whose
+        # status is known haven't changed since they were last checked, and
+        # neither has anything they depend on, see dependency_changed.
+        unknown = [f for f in candidates
+                   if f.owner.row_status is formularow.RowStatus.UNKNOWN]
+
+        def validated(results):
+            for f, ok in zip(unknown, results):
+                f.owner.row_status = formularow.RowStatus.GOOD if ok \
+                    else formularow.RowStatus.BAD
+            # a row can only be drawn if the rows it depends on can be too
+            valid = []
+            for f in candidates:
+                if f.owner.row_status is formularow.RowStatus.GOOD:
+                    if all(d in valid for d in formularow.with_dependencies(f, candidates)[:-1]):
+                        valid.append(f)
+                    else:
+                        f.owner.row_status = formularow.RowStatus.BAD
+
+            # Variables which no drawn row needs are left out of the shader
+            live = self.dependencies.needed(
+                f for f in valid if isinstance(f, formularow.DRAWN_TYPES))
+            valid = [f for f in valid
+                     if f in live or not isinstance(f, formularow.Variable)]
+            for f in candidates:
+                if f not in valid:
+                    f.slot = None
+            self.attempt_shader([valid, []])
+        self.gl_area.validate(unknown, candidates, validated)
+
+    def update_rows(self):
+        """Pass the colour and visibility of the rows to the graph, which
+        doesn't need the shader to be rebuilt."""
+        self.gl_area.update_rows([r.get_data() for r in self.rows])
+
+    def attempt_shader(self, candidates):
+        """Build a shader from the first candidate list of rows, falling back
+        to the next candidate whenever one fails to compile."""
+        formulae, *fallbacks = candidates
+
+        def ready():
             for f in formulae:
                 f.owner.row_status = formularow.RowStatus.GOOD
 
-        try:
-            attempt(good + bad + unknown)
-        except RuntimeError:
-            try:
-                attempt(good + unknown)
-            except RuntimeError:
-                try:
-                    attempt(good)
-                except RuntimeError:
-                    attempt([])
+        def failed(error):
+            if fallbacks:
+                self.attempt_shader(fallbacks)
+            else:
+                # this is called from the main loop, where raising the error
+                # would only print it
+                self.errorlabel.set_text(utils.shader_error_str(error))
+                self.errorbar.props.revealed = True
+
+        self.gl_area.update_fragment_shader(formulae, ready, failed)
 
     def dependency_changed(self, row):
-        for r in self.rows:
-            r.row_status = formularow.RowStatus.UNKNOWN
+        """Mark the rows which depend on the name row defined, or defines
+        now, or which define it too, as needing to be checked again."""
+        names = {node.name for f, node in self.dependencies.nodes.items()
+                 if f.owner is row}
+        names.add(getattr(row.get_data(), "name", None))
+        names.discard(None)
+        definers = [f for name in names for f in self.dependencies.definers[name]]
+        for f in self.dependencies.dependents(names).union(definers):
+            f.owner.row_status = formularow.RowStatus.UNKNOWN
 
     def add_equation(self, _, record=True):
         row = formularow.FormulaBox(self)
@@ -333,6 +406,7 @@ class Plots(Adw.Application):
         self.redo_button.props.sensitive = self.can_redo()
 
     def prefs_updated(self, prefs):
+        self.update_shader()
         self.gl_area.queue_draw()
 
 
@@ -42,6 +42,12 @@ class Preferences(GObject.GObject):
         "rendering": {
             "line_thickness": 2.0,
             "samples": 32,
+            "layered": False,
+            "render_scale": 1.0,
+            "progressive": False,
+            "auto_quality": False,
+            "frame_budget": 16.0,
+            "analytic": False,
         }
     }
     CONFIG_DIR = "plots"
@@ -62,7 +68,10 @@ class Preferences(GObject.GObject):
             for option in datasec.keys() & config[sec].keys():
                 if option in datasec:
                     t = type(datasec[option])
-                    datasec[option] = t(config[sec][option])
+                    if t is bool:
+                        datasec[option] = config[sec].getboolean(option)
+                    else:
+                        datasec[option] = t(config[sec][option])
 
     def save_config(self):
         conf_dir = f"{xdg_config_home()}/{self.CONFIG_DIR}"
@@ -95,6 +104,12 @@ class PreferencesWindow(Adw.PreferencesWindow):
 
     line_thickness_scale = Gtk.Template.Child()
     samples_scale = Gtk.Template.Child()
+    layered_switch = Gtk.Template.Child()
+    render_scale_scale = Gtk.Template.Child()
+    progressive_switch = Gtk.Template.Child()
+    auto_quality_switch = Gtk.Template.Child()
+    frame_budget_scale = Gtk.Template.Child()
+    analytic_switch = Gtk.Template.Child()
 
     def __init__(self, prefs, parent_window):
         super().__init__()
@@ -113,7 +128,28 @@ class PreferencesWindow(Adw.PreferencesWindow):
         self.samples_scale.set_digits(0)
         self.samples_scale.set_increments(1, 10)
 
+        self.layered_switch.set_active(prefs["rendering"]["layered"])
+
+        self.render_scale_scale.set_range(0.25, 1)
+        self.render_scale_scale.set_increments(0.05, 0.25)
+        self.render_scale_scale.set_value(prefs["rendering"]["render_scale"])
+
+        self.progressive_switch.set_active(prefs["rendering"]["progressive"])
+
+        self.auto_quality_switch.set_active(prefs["rendering"]["auto_quality"])
+        self.frame_budget_scale.set_range(4, 50)
+        self.frame_budget_scale.set_increments(1, 10)
+        self.frame_budget_scale.set_value(prefs["rendering"]["frame_budget"])
+
+        self.analytic_switch.set_active(prefs["rendering"]["analytic"])
+
     def delete_cb(self, window):
         r = self.prefs["rendering"]
         r["line_thickness"] = self.line_thickness_scale.get_value()
         r["samples"] = int(self.samples_scale.get_value())
+        r["layered"] = self.layered_switch.get_active()
+        r["render_scale"] = self.render_scale_scale.get_value()
+        r["progressive"] = self.progressive_switch.get_active()
+        r["auto_quality"] = self.auto_quality_switch.get_active()
+        r["frame_budget"] = self.frame_budget_scale.get_value()
+        r["analytic"] = self.analytic_switch.get_active()
@@ -0,0 +1,97 @@
+# Copyright 2022 Alexander Huntley
+
+# This file is part of Plots.
+
+# Plots is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Plots is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+import OpenGL.GL as gl
+from collections import deque
+from contextlib import contextmanager
+
+
+class FrameTimer():
+    """Measures the GPU time taken to draw frames using GL_TIME_ELAPSED
+    queries. Results are collected a few frames later, once they are
+    available, so timing never stalls the pipeline."""
+    QUERIES = 4
+
+    def __init__(self):
+        self.free = list(gl.glGenQueries(self.QUERIES))
+        self.pending = deque()
+
+    @contextmanager
+    def time(self):
+        if not self.free:
+            # all queries are still in flight, so skip timing this frame
+            yield
+            return
+        query = self.free.pop()
+        gl.glBeginQuery(gl.GL_TIME_ELAPSED, query)
+        try:
+            yield
+        finally:
+            gl.glEndQuery(gl.GL_TIME_ELAPSED)
+            self.pending.append(query)
+
+    def results(self):
+        """Yield the times, in milliseconds, of finished frames."""
+        while self.pending and gl.glGetQueryObjectiv(
+                self.pending[0], gl.GL_QUERY_RESULT_AVAILABLE):
+            query = self.pending.popleft()
+            elapsed = gl.glGetQueryObjectuiv(query, gl.GL_QUERY_RESULT)
+            self.free.append(query)
+            yield elapsed / 1e6
+
+
+class QualityController():
+    """Chooses samples per pixel and a render scale to keep frames within a
+    time budget.
+
+    The cost of a frame is taken to be proportional to samples*scale**2.
+    When over budget, samples are reduced first, and the scale only once
+    samples are at their minimum; when well under budget the scale is
+    restored first. Changes are limited per frame to avoid oscillating.
+    """
+    MIN_SAMPLES = 4
+    MAX_SAMPLES = 128
+    MIN_SCALE = 0.25
+    # fraction of the budget below which quality is increased
+    HEADROOM = 0.6
+    MAX_STEP = 2
+
+    def __init__(self, samples=32):
+        self.samples = samples
+        self.scale = 1.0
+
+    def update(self, elapsed, budget):
+        if elapsed <= 0:
+            return
+        ratio = budget / elapsed
+        if ratio < 1:
+            factor = max(ratio, 1/self.MAX_STEP)
+        elif ratio*self.HEADROOM > 1:
+            factor = min(ratio*self.HEADROOM, self.MAX_STEP)
+        else:
+            return
+        if factor < 1:
+            samples = max(self.samples*factor, self.MIN_SAMPLES)
+            # whatever reducing samples couldn't achieve comes from the scale
+            remaining = factor * self.samples / samples
+            self.samples = round(samples)
+            self.scale = max(self.scale*remaining**0.5, self.MIN_SCALE)
+        else:
+            scale = min(self.scale*factor**0.5, 1.0)
+            remaining = factor * (self.scale/scale)**2
+            self.scale = scale
+            self.samples = round(min(self.samples*remaining, self.MAX_SAMPLES))
@@ -61,17 +61,19 @@ class Edit():
         self.after = new
 
     def do(self, app):
-        row = app.rows[self.index]
-        row.editor.set_expr(parser.from_latex(self.after.formula))
-        row.color_picker.set_rgba(self.after.rgba)
-        row.editor.grab_focus()
-        row.editor.queue_draw()
-        row.edited(None, record=False)
+        self.restore(app.rows[self.index], self.after)
 
     def undo(self, app):
-        row = app.rows[self.index]
-        row.editor.set_expr(parser.from_latex(self.before.formula))
-        row.color_picker.set_rgba(self.before.rgba)
+        self.restore(app.rows[self.index], self.before)
+
+    @staticmethod
+    def restore(row, memory):
+        row.color_picker.set_rgba(memory.rgba)
+        if memory.formula == row.editor.expr.to_latex():
+            # only the colour changed, which doesn't need a new shader
+            row.recolored(record=False)
+            return
+        row.editor.set_expr(parser.from_latex(memory.formula))
         row.editor.grab_focus()
         row.editor.queue_draw()
         row.edited(None, record=False)
@@ -0,0 +1,310 @@
+# Copyright 2022 Alexander Huntley
+
+# This file is part of Plots.
+
+# Plots is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Plots is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+from collections import OrderedDict
+
+from gi.repository import GLib
+import OpenGL.GL as gl
+from OpenGL.GL import shaders
+from OpenGL.GL.KHR.parallel_shader_compile import \
+    glInitParallelShaderCompileKHR, glMaxShaderCompilerThreadsKHR, \
+    GL_COMPLETION_STATUS_KHR
+
+
+def source_key(source):
+    return hashlib.sha1(source.encode()).hexdigest()
+
+
+class Program(shaders.ShaderProgram):
+    """A linked program together with the locations of its active uniforms.
+
+    The locations are read once, at link time, so looking one up is a
+    dictionary access instead of a glGetUniformLocation call. Unknown names
+    give -1, which glUniform* silently ignores, just like GL would.
+    """
+    def __new__(cls, program):
+        self = super().__new__(cls, program)
+        self.uniforms = {}
+        for i in range(gl.glGetProgramiv(self, gl.GL_ACTIVE_UNIFORMS)):
+            name, size, type = gl.glGetActiveUniform(self, i)
+            name = name.decode()
+            location = gl.glGetUniformLocation(self, name)
+            self.uniforms[name] = location
+            # arrays are reported as name[0]
+            if name.endswith("[0]"):
+                self.uniforms[name[:-3]] = location
+        return self
+
+    def uniform(self, name):
+        return self.uniforms.get(name, -1)
+
+    def bind_block(self, name, binding):
+        """Bind the uniform block called name to the buffer binding point
+        binding, if the program uses the block."""
+        index = gl.glGetUniformBlockIndex(self, name)
+        if index != gl.GL_INVALID_INDEX:
+            gl.glUniformBlockBinding(self, index, binding)
+
+
+def compile_program(vertex_shader, source):
+    """Compile a fragment shader and link it with vertex_shader into a Program.
+
+    Unlike shaders.compileProgram this doesn't delete vertex_shader, so it can
+    go on being shared with other programs.
+    """
+    fragment_shader = shaders.compileShader(source, gl.GL_FRAGMENT_SHADER)
+    program = gl.glCreateProgram()
+    gl.glAttachShader(program, vertex_shader)
+    gl.glAttachShader(program, fragment_shader)
+    gl.glLinkProgram(program)
+    gl.glDetachShader(program, fragment_shader)
+    gl.glDeleteShader(fragment_shader)
+    return Program(program).check_linked()
+
+
+class ProgramCache():
+    """LRU cache of linked programs, keyed by a hash of the fragment source.
+
+    All programs share the same vertex shader, so the fragment source alone
+    identifies a program. Evicted programs are deleted, so the cache must only
+    be used while the owning GL context is current.
+    """
+    def __init__(self, capacity=16):
+        self.capacity = capacity
+        self.programs = OrderedDict()
+
+    def __contains__(self, source):
+        return source_key(source) in self.programs
+
+    def lookup(self, source):
+        key = source_key(source)
+        program = self.programs.get(key)
+        if program is not None:
+            self.programs.move_to_end(key)
+        return program
+
+    def insert(self, source, program):
+        key = source_key(source)
+        old = self.programs.pop(key, None)
+        if old is not None and old != program:
+            gl.glDeleteProgram(old)
+        self.programs[key] = program
+        while len(self.programs) > self.capacity:
+            _, evicted = self.programs.popitem(last=False)
+            gl.glDeleteProgram(evicted)
+
+    def clear(self):
+        for program in self.programs.values():
+            gl.glDeleteProgram(program)
+        self.programs.clear()
+
+
+class ShaderValidator():
+    """Remembers whether fragment sources compile and link, keyed by a hash
+    of the source. The checks are made by a ValidationJob."""
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.results = OrderedDict()
+
+    def __contains__(self, source):
+        return source_key(source) in self.results
+
+    def result(self, source):
+        key = source_key(source)
+        self.results.move_to_end(key)
+        return self.results[key]
+
+    def record(self, source, ok):
+        self.results[source_key(source)] = ok
+        while len(self.results) > self.capacity:
+            self.results.popitem(last=False)
+
+
+class CompileJob():
+    """Compiles and links a list of fragment sources against a vertex shader.
+
+    Sources already in the cache are not recompiled. The compiles are only
+    issued by start(); with GL_KHR_parallel_shader_compile the driver then
+    works on them in the background and ready() can be polled without
+    blocking. Without it, each compile blocks, so start() can issue a few at
+    a time.
+    """
+    def __init__(self, vertex_shader, sources, cache, on_ready, on_error):
+        self.vertex_shader = vertex_shader
+        self.sources = sources
+        self.cache = cache
+        self.on_ready = on_ready
+        self.on_error = on_error
+        self.pending = {}
+
+    def start(self, limit=None):
+        """Issue the compiles of the sources, or of at most limit more of
+        them, and return whether they have all been issued."""
+        for source in self.sources:
+            if source in self.cache or source in self.pending:
+                continue
+            if limit is not None:
+                if limit == 0:
+                    return False
+                limit -= 1
+            fragment_shader = gl.glCreateShader(gl.GL_FRAGMENT_SHADER)
+            gl.glShaderSource(fragment_shader, source)
+            gl.glCompileShader(fragment_shader)
+            program = gl.glCreateProgram()
+            gl.glAttachShader(program, self.vertex_shader)
+            gl.glAttachShader(program, fragment_shader)
+            gl.glLinkProgram(program)
+            if limit is not None:
+                # make the driver do the work now, rather than all of it at
+                # once when finish() asks for the results
+                gl.glGetProgramiv(program, gl.GL_LINK_STATUS)
+            self.pending[source] = (program, fragment_shader)
+        return True
+
+    def ready(self):
+        return all(gl.glGetProgramiv(program, GL_COMPLETION_STATUS_KHR)
+                   for program, _ in self.pending.values())
+
+    def finish(self):
+        """Return the programs in source order, moving new ones into the cache.
+
+        Raises RuntimeError if any source failed to compile or link.
+        """
+        error = None
+        for source, (program, fragment_shader) in self.pending.items():
+            if not gl.glGetShaderiv(fragment_shader, gl.GL_COMPILE_STATUS):
+                error = error or shaders.ShaderCompilationError(
+                    "Shader compile failure: {}".format(
+                        gl.glGetShaderInfoLog(fragment_shader).decode()),
+                    source, gl.GL_FRAGMENT_SHADER)
+            elif not gl.glGetProgramiv(program, gl.GL_LINK_STATUS):
+                error = error or shaders.ShaderLinkError(
+                    "Link failure: {}".format(
+                        gl.glGetProgramInfoLog(program).decode()))
+            gl.glDetachShader(program, fragment_shader)
+            gl.glDeleteShader(fragment_shader)
+            if error is None:
+                self.cache.insert(source, Program(program))
+            else:
+                gl.glDeleteProgram(program)
+        self.pending.clear()
+        if error is not None:
+            raise error
+        return [self.cache.lookup(source) for source in self.sources]
+
+    def cancel(self):
+        for program, fragment_shader in self.pending.values():
+            gl.glDeleteShader(fragment_shader)
+            gl.glDeleteProgram(program)
+        self.pending.clear()
+
+
+class ValidationJob(CompileJob):
+    """Checks whether fragment sources compile and link, in the same way as
+    CompileJob builds them, recording the results in a ShaderValidator
+    instead of keeping the programs."""
+    def finish(self):
+        """Return whether each source compiled and linked, in source order."""
+        for source, (program, fragment_shader) in self.pending.items():
+            ok = bool(gl.glGetShaderiv(fragment_shader, gl.GL_COMPILE_STATUS)) \
+                and bool(gl.glGetProgramiv(program, gl.GL_LINK_STATUS))
+            gl.glDetachShader(program, fragment_shader)
+            gl.glDeleteShader(fragment_shader)
+            gl.glDeleteProgram(program)
+            self.cache.record(source, ok)
+        self.pending.clear()
+        return [self.cache.result(source) for source in self.sources]
+
+
+class ShaderCompiler():
+    """Compiles programs for a GLArea without blocking the main loop.
+
+    Only the most recently submitted job, whether it builds programs or
+    validates sources, is kept: submitting a new one cancels any compile
+    still in flight, so the area keeps drawing its previous
+    program until the latest one is ready. Where the driver supports
+    GL_KHR_parallel_shader_compile the job is polled for completion.
+    Otherwise its programs are compiled one per idle callback, so the edit
+    which triggered it returns immediately and superseded edits are never
+    compiled, but each compile still blocks the main loop while it runs.
+    """
+    POLL_INTERVAL = 5
+
+    def __init__(self, gl_area, cache, validator):
+        self.gl_area = gl_area
+        self.cache = cache
+        self.validator = validator
+        self.job = None
+        self.source_id = None
+        self.parallel = False
+
+    def realize(self):
+        self.parallel = bool(glInitParallelShaderCompileKHR())
+        if self.parallel:
+            # let the driver choose how many threads to use
+            glMaxShaderCompilerThreadsKHR(0xFFFFFFFF)
+
+    def submit(self, vertex_shader, sources, on_ready, on_error):
+        """Build programs from sources, then call on_ready(programs), or
+        on_error(error) if any of them fails."""
+        self.cancel()
+        # every program of a job must fit in the cache alongside the previous
+        # job's, so that switching back and forth doesn't recompile
+        self.cache.capacity = max(self.cache.capacity, 2*len(sources))
+        self.run(CompileJob(vertex_shader, sources, self.cache, on_ready, on_error))
+
+    def validate(self, vertex_shader, sources, on_ready):
+        """Check whether each of sources compiles and links, then call
+        on_ready with a list of the results."""
+        self.cancel()
+        self.run(ValidationJob(vertex_shader, sources, self.validator, on_ready, None))
+
+    def run(self, job):
+        if all(source in job.cache for source in job.sources):
+            job.on_ready(job.finish())
+            return
+        self.job = job
+        if self.parallel:
+            job.start()
+            self.source_id = GLib.timeout_add(self.POLL_INTERVAL, self.poll)
+        else:
+            self.source_id = GLib.idle_add(self.poll)
+
+    def poll(self):
+        self.gl_area.make_current()
+        job = self.job
+        if not self.parallel:
+            if not job.start(limit=1):
+                return GLib.SOURCE_CONTINUE
+        elif not job.ready():
+            return GLib.SOURCE_CONTINUE
+        self.job = self.source_id = None
+        try:
+            programs = job.finish()
+        except RuntimeError as error:
+            job.on_error(error)
+        else:
+            job.on_ready(programs)
+        return GLib.SOURCE_REMOVE
+
+    def cancel(self):
+        if self.job is not None:
+            GLib.source_remove(self.source_id)
+            self.gl_area.make_current()
+            self.job.cancel()
+            self.job = self.source_id = None
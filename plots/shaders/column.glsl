@@ -0,0 +1,76 @@
+/*
+   Copyright 2022 Alexander Huntley
+
+   This file is part of Plots.
+
+   Plots is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   Plots is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+#version 330 core
+out vec4 rgba;
+
+{% include "common.glsl" %}
+
+{% for f in formulae[:-1] %}
+{{ f.definition() }}
+{% endfor %}
+{{ formula.uniforms() }}
+{{ formula.function() }}
+{{ formulae[:-1] | load_sliders }}
+
+// Evaluates an explicit formula once for each column (or, for x = f(y), each
+// row) of the scene. Texel (n, i) for i < samples holds the i-th jittered
+// sample of column n; texel (n, samples) holds the minimum and maximum of the
+// finite samples, the monotonic count and whether any sample was NaN or
+// infinite.
+void main() {
+    load_sliders();
+    float sample_extent = line_thickness*pixel_extent.x;
+    float step = sample_extent / samples;
+    float jitter = .4;
+
+    {% for f in formulae[:-1] %}
+    {{ f.calculation() }}
+    {% endfor %}
+
+    int axis = {{ formula.axis }};
+    float centre = (2*gl_FragCoord.x/resolution[axis] - 1)
+        * viewport[axis]/viewport.x * scale - translation[axis];
+    int n = int(gl_FragCoord.y);
+    if (n < int(samples)) {
+        float i = float(n);
+        float ii = i + jitter*rand(vec2(centre + i*step, centre)) - samples/2;
+        rgba = vec4(formula{{ formula.id() }}(centre + ii*step), 0, 0, 0);
+        return;
+    }
+
+    float lo = 3.4e38;
+    float hi = -3.4e38;
+    float prev = 0;
+    int monotonic = 0;
+    bool nans = false;
+    for (float i = 0.0; i < samples; i++) {
+        float ii = i + jitter*rand(vec2(centre + i*step, centre)) - samples/2;
+        float f = formula{{ formula.id() }}(centre + ii*step);
+        if (i != 0.0)
+            monotonic += int(sign(f - prev));
+        prev = f;
+        if (isinf(f) || isnan(f)) {
+            nans = true;
+        } else {
+            lo = min(lo, f);
+            hi = max(hi, f);
+        }
+    }
+    rgba = vec4(lo, hi, monotonic, nans ? 1 : 0);
+}
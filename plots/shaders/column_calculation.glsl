@@ -0,0 +1,30 @@
+{% set along = "xy"[formula.axis] %}
+{% set across = "yx"[formula.axis] %}
+// Shades an explicit formula from the samples of its column, evaluated
+// beforehand by column.glsl, instead of calling the formula itself
+int column = int(gl_FragCoord.{{ along }});
+vec4 stats = texelFetch(prepass{{ formula.id() }}, ivec2(column, int(samples)), 0);
+formula_color = vec4(row_colors[{{ formula.id() }}].rgb, 1);
+// if every sample is further away than the widest band then none of them are
+// inside it, and all are on the same side, so the pixel is untouched
+if (abs(int(stats.z)) != int(samples) - 3 && stats.w == 0.0
+    && stats.x - sample_extent < graph_pos.{{ across }}
+    && graph_pos.{{ across }} < stats.y + sample_extent) {
+    float inside = 0;
+    float outside = 0;
+    for (float i = 0.0; i < samples; i++) {
+        float j = jitter*rand(vec2(graph_pos.{{ across }}, graph_pos.{{ across }} + i*step));
+        float lower = (-0.5+j)*sample_extent;
+        float upper = (0.5+j)*sample_extent;
+        float f = texelFetch(prepass{{ formula.id() }}, ivec2(column, int(i)), 0).r
+            - graph_pos.{{ across }};
+        if (lower < f && f < upper)
+            inside += 1.0;
+        else
+            outside += sign(f);
+    }
+    if (inside > 0.0)
+        color = mix(color, formula_color, inside/samples);
+    if (abs(outside) != samples)
+        color = mix(color, formula_color, 1. - abs(outside)/samples);
+}
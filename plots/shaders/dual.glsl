@@ -0,0 +1,75 @@
+/*
+   Copyright 2022 Alexander Huntley
+
+   This file is part of Plots.
+
+   Plots is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   Plots is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+// Dual numbers: x holds the value and yz its derivatives with respect to the
+// graph's x and y. Sums, differences and scaling by a float work directly on
+// the vec3; everything else goes through these functions.
+
+vec3 d_mul(vec3 a, vec3 b) {
+    return vec3(a.x*b.x, a.x*b.yz + b.x*a.yz);
+}
+
+vec3 d_div(vec3 a, vec3 b) {
+    return vec3(a.x/b.x, (a.yz*b.x - a.x*b.yz)/(b.x*b.x));
+}
+
+// f(a), given f(a.x) and f'(a.x)
+vec3 d_chain(vec3 a, float f, float df) {
+    return vec3(f, df*a.yz);
+}
+
+vec3 d_sin(vec3 a) { return d_chain(a, sin(a.x), cos(a.x)); }
+vec3 d_cos(vec3 a) { return d_chain(a, cos(a.x), -sin(a.x)); }
+vec3 d_tan(vec3 a) { float c = cos(a.x); return d_chain(a, tan(a.x), 1/(c*c)); }
+vec3 d_asin(vec3 a) { return d_chain(a, asin(a.x), 1/sqrt(1 - a.x*a.x)); }
+vec3 d_acos(vec3 a) { return d_chain(a, acos(a.x), -1/sqrt(1 - a.x*a.x)); }
+vec3 d_atan(vec3 a) { return d_chain(a, atan(a.x), 1/(1 + a.x*a.x)); }
+vec3 d_acot(vec3 a) { return d_chain(a, acot(a.x), -1/(1 + a.x*a.x)); }
+vec3 d_sinh(vec3 a) { return d_chain(a, sinh(a.x), cosh(a.x)); }
+vec3 d_cosh(vec3 a) { return d_chain(a, cosh(a.x), sinh(a.x)); }
+vec3 d_tanh(vec3 a) { float t = tanh(a.x); return d_chain(a, t, 1 - t*t); }
+vec3 d_asinh(vec3 a) { return d_chain(a, asinh(a.x), 1/sqrt(a.x*a.x + 1)); }
+vec3 d_acosh(vec3 a) { return d_chain(a, acosh(a.x), 1/sqrt(a.x*a.x - 1)); }
+vec3 d_atanh(vec3 a) { return d_chain(a, atanh(a.x), 1/(1 - a.x*a.x)); }
+vec3 d_exp(vec3 a) { float f = exp(a.x); return d_chain(a, f, f); }
+vec3 d_log(vec3 a) { return d_chain(a, log(a.x), 1/a.x); }
+vec3 d_log2(vec3 a) { return d_chain(a, log2(a.x), 1/(a.x*log(2.0))); }
+vec3 d_sqrt(vec3 a) { float f = sqrt(a.x); return d_chain(a, f, 0.5/f); }
+vec3 d_abs(vec3 a) { return d_chain(a, abs(a.x), sign(a.x)); }
+// piecewise constant functions
+vec3 d_sign(vec3 a) { return vec3(sign(a.x), 0, 0); }
+vec3 d_floor(vec3 a) { return vec3(floor(a.x), 0, 0); }
+vec3 d_ceil(vec3 a) { return vec3(ceil(a.x), 0, 0); }
+vec3 d_factorial(vec3 a) { return vec3(factorial(a.x), 0, 0); }
+
+vec3 d_mypow(vec3 a, vec3 b) {
+    float f = mypow(a.x, b.x);
+    vec2 df = b.x*mypow(a.x, b.x - 1)*a.yz;
+    // the exponent's derivative is usually zero, and log(a.x) may not exist
+    if (b.yz != vec2(0))
+        df += f*log(a.x)*b.yz;
+    return vec3(f, df);
+}
+
+vec3 d_pow(vec3 a, vec3 b) {
+    float f = pow(a.x, b.x);
+    vec2 df = b.x*pow(a.x, b.x - 1)*a.yz;
+    if (b.yz != vec2(0))
+        df += f*log(a.x)*b.yz;
+    return vec3(f, df);
+}
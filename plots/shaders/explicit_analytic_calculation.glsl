@@ -0,0 +1,9 @@
+{% set along = "xy"[formula.axis] %}
+{% set across = "yx"[formula.axis] %}
+// Shades an explicit formula by the distance of the pixel from the curve,
+// estimated from the formula's value and derivative at the pixel
+vec3 f = formula{{ formula.id() }}(vec3(graph_pos.{{ along }}, 1, 0));
+float distance = abs(f.x - graph_pos.{{ across }})/length(vec2(f.y, 1))/pixel_extent.x;
+formula_color = vec4(row_colors[{{ formula.id() }}].rgb, 1);
+if (!isnan(distance) && !isinf(distance))
+    color = mix(color, formula_color, clamp(line_thickness/2 + 0.5 - distance, 0, 1));
@@ -0,0 +1,46 @@
+/*
+   Copyright 2022 Alexander Huntley
+
+   This file is part of Plots.
+
+   Plots is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   Plots is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+#version 330 core
+out vec4 rgba;
+
+{% include "common.glsl" %}
+
+{% for f in formulae[:-1] %}
+{{ f.definition() }}
+{% endfor %}
+{{ formula.uniforms() }}
+{{ formula.function() }}
+{{ formulae[:-1] | load_sliders }}
+
+// Evaluates an implicit formula once at the centre of each pixel of the
+// scene, and of a margin field_border pixels wide around it
+void main() {
+    load_sliders();
+    float sample_extent = line_thickness*pixel_extent.x;
+    float step = sample_extent / samples;
+    float jitter = .4;
+
+    {% for f in formulae[:-1] %}
+    {{ f.calculation() }}
+    {% endfor %}
+
+    vec2 pixel = gl_FragCoord.xy - field_border;
+    vec2 pos = (2*pixel/resolution - 1) * viewport/viewport.x * scale - translation;
+    rgba = vec4(formula{{ formula.id() }}(pos.x, pos.y), 0, 0, 0);
+}
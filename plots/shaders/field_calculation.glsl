@@ -0,0 +1,29 @@
+// Shades an implicit formula from its values at each pixel, evaluated
+// beforehand by field.glsl, interpolating between them instead of calling
+// the formula at every sample
+float positives = 0, sample_count = 0;
+float sqrt_samples = round(sqrt(samples)/2);
+bool nans = false;
+float _step = 2*6*step, _jitter = 4*jitter;
+vec2 field_size = resolution + 2*field_border;
+for (float i = -sqrt_samples; i < sqrt_samples; i++) {
+    for (float j = -sqrt_samples; j < sqrt_samples; j++) {
+        vec2 v = vec2(graph_pos.x + i*_step, graph_pos.y + j*_step);
+        float ii = i + _jitter*rand(v);
+        float _x = graph_pos.x + ii*_step;
+        float jj = j + _jitter*rand(v.yx);
+        float _y = graph_pos.y + jj*_step;
+        vec2 normalised = (vec2(_x, _y) + translation)/scale * viewport.x/viewport;
+        vec2 pixel = (normalised + 1)/2 * resolution + field_border;
+        float f = texture(prepass{{ formula.id() }}, pixel/field_size).r;
+        if (f > 0)
+            positives += 1;
+        nans = nans || isinf(f) || isnan(f);
+        sample_count += 1;
+    }
+}
+formula_color = vec4(row_colors[{{ formula.id() }}].rgb, 1);
+if (positives != 0 && positives != sample_count && !nans) {
+    color = mix(color, formula_color,
+                1 - abs(2*positives/sample_count - 1));
+}
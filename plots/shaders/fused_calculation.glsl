@@ -0,0 +1,83 @@
+{% set along = "xy"[group.axis] %}
+{% set across = "yx"[group.axis] %}
+// Several explicit formulae sampled in a single loop, so that the jitter of
+// each sample is only computed once for all of them
+{% if group.prepass %}
+int column = int(gl_FragCoord.{{ along }});
+{% endif %}
+{% for f in group.rows %}
+{% set n = f.id() %}
+float inside{{n}} = 0;
+float outside{{n}} = 0;
+{% if group.prepass %}
+vec4 stats{{n}} = texelFetch(prepass{{n}}, ivec2(column, int(samples)), 0);
+bool near{{n}} = visible({{n}}) && abs(int(stats{{n}}.z)) != int(samples) - 3 && stats{{n}}.w == 0.0
+    && stats{{n}}.x - sample_extent < graph_pos.{{ across }}
+    && graph_pos.{{ across }} < stats{{n}}.y + sample_extent;
+{% else %}
+float prev{{n}} = 0;
+int monotonic{{n}} = 0;
+bool nans{{n}} = false;
+{% if f.interval %}
+vec2 bounds{{n}} = formula{{n}}(graph_pos.{{ along }} + vec2(-1, 1)*(samples/2 + 1)*step)
+    - graph_pos.{{ across }};
+bool near{{n}} = visible({{n}})
+    && !(bounds{{n}}.x > (0.5+jitter)*sample_extent
+         || bounds{{n}}.y < -(0.5+jitter)*sample_extent);
+{% else %}
+bool near{{n}} = visible({{n}});
+{% endif %}
+{% endif %}
+{% endfor %}
+if ({% for f in group.rows %}near{{ f.id() }}{{ " || " if not loop.last }}{% endfor %}) {
+    for (float i = 0.0; i < samples; i++) {
+{% if group.prepass or group.axis == 0 %}
+        float j = jitter*rand(vec2(graph_pos.{{ across }}, graph_pos.{{ across }} + i*step));
+{% else %}
+        float j = jitter*rand(vec2(graph_pos.x + i*step, graph_pos.y));
+{% endif %}
+{% if not group.prepass %}
+{% if group.axis == 0 %}
+        float ii = i + jitter*rand(vec2(graph_pos.x + i*step, graph_pos.y)) - samples/2;
+{% else %}
+        float ii = i + jitter*rand(vec2(graph_pos.x, graph_pos.y + i*step)) - samples/2;
+{% endif %}
+        float t = graph_pos.{{ along }} + ii*step;
+{% endif %}
+        float lower = (-0.5+j)*sample_extent;
+        float upper = (0.5+j)*sample_extent;
+{% for f in group.rows %}
+{% set n = f.id() %}
+        if (near{{n}}) {
+{% if group.prepass %}
+            float f = texelFetch(prepass{{n}}, ivec2(column, int(i)), 0).r
+                - graph_pos.{{ across }};
+{% else %}
+            float f = formula{{n}}(t) - graph_pos.{{ across }};
+            if (i != 0.0)
+                monotonic{{n}} += int(sign(f - prev{{n}}));
+            prev{{n}} = f;
+            nans{{n}} = nans{{n}} || isinf(f) || isnan(f);
+{% endif %}
+            if (lower < f && f < upper)
+                inside{{n}} += 1.0;
+            else
+                outside{{n}} += sign(f);
+        }
+{% endfor %}
+    }
+}
+{% for f in group.rows %}
+{% set n = f.id() %}
+formula_color = vec4(row_colors[{{ f.id() }}].rgb, 1);
+{% if group.prepass %}
+if (near{{n}}) {
+{% else %}
+if (near{{n}} && abs(monotonic{{n}}) != int(samples) - 3 && !nans{{n}}) {
+{% endif %}
+    if (inside{{n}} > 0.0)
+        color = mix(color, formula_color, inside{{n}}/samples);
+    if (abs(outside{{n}}) != samples)
+        color = mix(color, formula_color, 1. - abs(outside{{n}})/samples);
+}
+{% endfor %}
@@ -0,0 +1,7 @@
+// Shades an implicit formula by the distance of the pixel from the curve,
+// estimated as |f|/|grad f| at the pixel
+vec3 f = formula{{ formula.id() }}(vec3(graph_pos.x, 1, 0), vec3(graph_pos.y, 0, 1));
+float distance = abs(f.x)/length(f.yz)/pixel_extent.x;
+formula_color = vec4(row_colors[{{ formula.id() }}].rgb, 1);
+if (!isnan(distance) && !isinf(distance))
+    color = mix(color, formula_color, clamp(line_thickness/2 + 0.5 - distance, 0, 1));
@@ -2,6 +2,13 @@ float positives = 0, sample_count = 0;
 float sqrt_samples = round(sqrt(samples)/2);
 bool nans = false;
 float _step = 2*6*step, _jitter = 4*jitter;
+{% if formula.interval %}
+// skip the samples if bounding the formula over all of them shows that it
+// has the same sign at each
+vec2 window = vec2(-1, 1)*(sqrt_samples + 2)*_step;
+vec2 bounds = formula{{ formula.id() }}(graph_pos.x + window, graph_pos.y + window);
+if (!(bounds.x > 0 || bounds.y < 0)) {
+{% endif %}
 for (float i = -sqrt_samples; i < sqrt_samples; i++) {
     for (float j = -sqrt_samples; j < sqrt_samples; j++) {
         vec2 v = vec2(graph_pos.x + i*_step, graph_pos.y + j*_step);
@@ -16,8 +23,11 @@ for (float i = -sqrt_samples; i < sqrt_samples; i++) {
         sample_count += 1;
     }
 }
-formula_color = vec3({{ formula.rgba[:3] | join(",") }});
+formula_color = vec4(row_colors[{{ formula.id() }}].rgb, 1);
 if (positives != 0 && positives != sample_count && !nans) {
     color = mix(color, formula_color,
                 1 - abs(2*positives/sample_count - 1));
 }
+{% if formula.interval %}
+}
+{% endif %}
@@ -0,0 +1,148 @@
+/*
+   Copyright 2022 Alexander Huntley
+
+   This file is part of Plots.
+
+   Plots is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   Plots is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+// Interval arithmetic: x is a lower and y an upper bound. Adding a float
+// works directly on the vec2; everything else goes through these functions.
+// Where a bound can't be found the result is NaN or infinite, which never
+// excludes anything.
+
+#define i_infinity (1./0.)
+#define i_everything vec2(-i_infinity, i_infinity)
+
+vec2 i_sub(vec2 a, vec2 b) {
+    return a - b.yx;
+}
+
+vec2 i_scale(vec2 a, float c) {
+    return c >= 0 ? a*c : a.yx*c;
+}
+
+vec2 i_mul(vec2 a, vec2 b) {
+    vec4 p = vec4(a.x*b, a.y*b);
+    if (any(isnan(p)))
+        return i_everything;
+    return vec2(min(min(p.x, p.y), min(p.z, p.w)), max(max(p.x, p.y), max(p.z, p.w)));
+}
+
+vec2 i_sqr(vec2 a) {
+    vec2 s = a*a;
+    if (a.x <= 0 && a.y >= 0)
+        return vec2(0, max(s.x, s.y));
+    return vec2(min(s.x, s.y), max(s.x, s.y));
+}
+
+vec2 i_div(vec2 a, vec2 b) {
+    if (b.x <= 0 && b.y >= 0)
+        return i_everything;
+    return i_mul(a, 1/b.yx);
+}
+
+// f over a, for f increasing or decreasing over the whole of a
+#define i_increasing(f, a) vec2(f((a).x), f((a).y))
+#define i_decreasing(f, a) vec2(f((a).y), f((a).x))
+
+vec2 i_sin(vec2 a) {
+    if (a.y - a.x >= 2*pi)
+        return vec2(-1, 1);
+    vec2 s = vec2(sin(a.x), sin(a.y));
+    vec2 r = vec2(min(s.x, s.y), max(s.x, s.y));
+    // a peak at pi/2 + 2k pi, or a trough at 3pi/2 + 2k pi, inside a
+    if (floor((a.y - pi/2)/(2*pi)) != floor((a.x - pi/2)/(2*pi)))
+        r.y = 1;
+    if (floor((a.y + pi/2)/(2*pi)) != floor((a.x + pi/2)/(2*pi)))
+        r.x = -1;
+    return r;
+}
+
+vec2 i_cos(vec2 a) { return i_sin(a + pi/2); }
+
+vec2 i_tan(vec2 a) {
+    // a pole at pi/2 + k pi inside a
+    if (a.y - a.x >= pi || floor((a.y - pi/2)/pi) != floor((a.x - pi/2)/pi))
+        return i_everything;
+    return i_increasing(tan, a);
+}
+
+vec2 i_asin(vec2 a) { return i_increasing(asin, clamp(a, -1, 1)); }
+vec2 i_acos(vec2 a) { return i_decreasing(acos, clamp(a, -1, 1)); }
+vec2 i_atan(vec2 a) { return i_increasing(atan, a); }
+
+vec2 i_acot(vec2 a) {
+    // acot jumps from below -pi to above 0 at 0
+    if (a.x <= 0 && a.y >= 0)
+        return vec2(-1.5*pi, pi/2);
+    return i_decreasing(acot, a);
+}
+
+vec2 i_sinh(vec2 a) { return i_increasing(sinh, a); }
+
+vec2 i_cosh(vec2 a) {
+    vec2 c = vec2(cosh(a.x), cosh(a.y));
+    if (a.x <= 0 && a.y >= 0)
+        return vec2(1, max(c.x, c.y));
+    return vec2(min(c.x, c.y), max(c.x, c.y));
+}
+
+vec2 i_tanh(vec2 a) { return i_increasing(tanh, a); }
+vec2 i_asinh(vec2 a) { return i_increasing(asinh, a); }
+vec2 i_acosh(vec2 a) { return i_increasing(acosh, max(a, 1)); }
+vec2 i_atanh(vec2 a) { return i_increasing(atanh, clamp(a, -1, 1)); }
+vec2 i_exp(vec2 a) { return i_increasing(exp, a); }
+vec2 i_log(vec2 a) { return i_increasing(log, max(a, 0)); }
+vec2 i_log2(vec2 a) { return i_increasing(log2, max(a, 0)); }
+vec2 i_sqrt(vec2 a) { return i_increasing(sqrt, max(a, 0)); }
+
+vec2 i_abs(vec2 a) {
+    vec2 b = abs(a);
+    if (a.x <= 0 && a.y >= 0)
+        return vec2(0, max(b.x, b.y));
+    return vec2(min(b.x, b.y), max(b.x, b.y));
+}
+
+vec2 i_sign(vec2 a) { return i_increasing(sign, a); }
+vec2 i_floor(vec2 a) { return i_increasing(floor, a); }
+vec2 i_ceil(vec2 a) { return i_increasing(ceil, a); }
+vec2 i_factorial(vec2 a) { return i_increasing(factorial, a); }
+
+vec2 i_pow(vec2 a, vec2 b) {
+    if (a.x < 0)
+        return i_everything;
+    // pow is monotonic in each argument for positive bases, so the bounds
+    // are at the corners
+    vec4 p = vec4(pow(a.x, b.x), pow(a.x, b.y), pow(a.y, b.x), pow(a.y, b.y));
+    if (any(isnan(p)))
+        return i_everything;
+    return vec2(min(min(p.x, p.y), min(p.z, p.w)), max(max(p.x, p.y), max(p.z, p.w)));
+}
+
+vec2 i_mypow(vec2 a, vec2 b) {
+    if (a.x >= 0)
+        return i_pow(a, b);
+    if (b.x != b.y || floor(b.x) != b.x)
+        return i_everything;
+    // a fixed integer exponent: odd powers are increasing, even ones are
+    // like abs
+    vec2 p = vec2(mypow(a.x, b.x), mypow(a.y, b.x));
+    if (b.x < 0 && a.y >= 0)
+        return i_everything;
+    if (int(b.x) % 2 != 0)
+        return vec2(min(p.x, p.y), max(p.x, p.y));
+    if (b.x > 0 && a.y >= 0)
+        return vec2(0, max(p.x, p.y));
+    return vec2(min(p.x, p.y), max(p.x, p.y));
+}
@@ -0,0 +1,37 @@
+/*
+   Copyright 2022 Alexander Huntley
+
+   This file is part of Plots.
+
+   Plots is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   Plots is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+*/
+
+#version 330 core
+in vec2 graph_pos;
+out vec4 rgba;
+uniform vec2 viewport;
+uniform sampler2D image;
+uniform vec2 cached_translation;
+uniform float cached_scale;
+
+// Draws a frame rendered at cached_translation and cached_scale as it would
+// appear at the current translation and scale, leaving the parts it doesn't
+// cover to be rendered properly
+void main() {
+    vec2 normalised = (graph_pos + cached_translation)/cached_scale;
+    vec2 uv = normalised*viewport.x/viewport*0.5 + 0.5;
+    if (any(lessThan(uv, vec2(0))) || any(greaterThan(uv, vec2(1))))
+        discard;
+    rgba = texture(image, uv);
+}
@@ -30,6 +30,10 @@ out vec4 fragColor;
 void main()
 {
     vec2 uv = vUV.xy;
-    float text = texture(u_texture, uv).r;
+    // signed distance to the outline of the glyph, 0.5 on the outline;
+    // smoothing over one pixel's worth keeps the edge crisp at any size
+    float distance = texture(u_texture, uv).r;
+    float width = fwidth(distance);
+    float text = smoothstep(0.5 - width, 0.5 + width, distance);
     fragColor = mix(vec4(bg_color, 1), vec4(fg_color, 1), text);
 }
@@ -23,11 +23,10 @@ layout (location = 0) in vec4 vertex;
 
 out vec2 vUV;
 
-uniform mat4 model;
 uniform mat4 projection;
 
 void main()
 {
     vUV         = vertex.zw;
-    gl_Position = projection * model * vec4(vertex.xy, 0.0, 1.0);
+    gl_Position = projection * vec4(vertex.xy, 0.0, 1.0);
 }
@@ -25,7 +25,7 @@ for (float i = 0.0; i < samples; i++) {
     prev = f;
     nans = nans || isinf(f) || isnan(f);
 }
-formula_color = vec3({{ formula.rgba[:3] | join(",") }});
+formula_color = vec4(row_colors[{{ formula.id() }}].rgb, 1);
 if (abs(monotonic) != int(samples) - 3 && !nans) {
     if (inside > 0.0)
         color = mix(color, formula_color, inside/samples);
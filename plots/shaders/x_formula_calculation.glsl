@@ -1,3 +1,10 @@
+{% if formula.interval %}
+// skip the samples if bounding the formula over all of them shows that none
+// can be near the pixel
+vec2 bounds = formula{{formula.id()}}(graph_pos.y + vec2(-1, 1)*(samples/2 + 1)*step)
+    - graph_pos.x;
+if (!(bounds.x > (0.5+jitter)*sample_extent || bounds.y < -(0.5+jitter)*sample_extent)) {
+{% endif %}
 float inside = 0;
 float outside = 0;
 float prev = 0;
@@ -22,10 +29,13 @@ for (float i = 0.0; i < samples; i++) {
     prev = f;
     nans = nans || isinf(f) || isnan(f);
 }
-formula_color = vec3({{ formula.rgba[:3] | join(",") }});
+formula_color = vec4(row_colors[{{ formula.id() }}].rgb, 1);
 if (abs(monotonic) != int(samples) - 3 && !nans) {
     if (inside > 0.0)
         color = mix(color, formula_color, inside/samples);
     if (abs(outside) != samples)
         color = mix(color, formula_color, 1. - abs(outside)/samples);
 }
+{% if formula.interval %}
+}
+{% endif %}
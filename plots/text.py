@@ -22,40 +22,194 @@ from OpenGL.GL import shaders
 from OpenGL.arrays import vbo
 import math
 import glm
+import hashlib
+import io
+import json
+import os
 import importlib.resources as resources
+from collections import OrderedDict, namedtuple
 from contextlib import contextmanager
 
+from plots.shaderprogram import Program
+
 
 # Code based on:
 # - rougier/freetype-py
 #   https://github.com/rougier/freetype-py/blob/master/examples/opengl.py
 # - LearnOpenGL Text Rendering
 #   https://learnopengl.com/In-Practice/Text-Rendering
+
+# Where a glyph is in the atlas, as texture coordinates (u0, v0, u1, v1), and
+# its metrics in pixels of the atlas
+Glyph = namedtuple("Glyph", "uv size bearing advance")
+
+
+def xdg_cache_home():
+    varname = "XDG_CACHE_HOME"
+    if varname in os.environ:
+        return os.environ[varname]
+    else:
+        return "{}/.cache".format(os.environ["HOME"])
+
+
+def signed_distance(coverage, spread):
+    """Return the signed distance field of a glyph bitmap, padded by spread
+    on every side so that it falls off outside the glyph.
+
+    The distance, in pixels, from the centre of each pixel to the outline is
+    mapped so that 0.5 is on the outline, more is inside and less is outside,
+    reaching 0 or 1 at spread pixels away. Distances are only looked for
+    within spread, which keeps this a few NumPy operations per offset.
+    """
+    inside = np.pad(coverage >= 128, spread)
+    h, w = inside.shape
+    # far enough out that every offset stays within the array
+    around = np.pad(inside, spread)
+    far = spread + 0.5
+    to_inside = np.full(inside.shape, far)
+    to_outside = np.full(inside.shape, far)
+    for dy in range(-spread, spread + 1):
+        for dx in range(-spread, spread + 1):
+            distance = math.hypot(dx, dy)
+            if distance >= far:
+                continue
+            shifted = around[spread + dy:spread + dy + h, spread + dx:spread + dx + w]
+            np.minimum(to_inside, np.where(shifted, distance, far), out=to_inside)
+            np.minimum(to_outside, np.where(shifted, far, distance), out=to_outside)
+    # the outline is half way between the centres of pixels either side of it
+    distance = np.where(inside, to_outside - 0.5, 0.5 - to_inside)
+    return np.clip(255*(0.5 + distance/(2*spread)), 0, 255).astype(np.uint8)
+
+
+class GlyphAtlas():
+    """A texture holding glyph bitmaps in a grid of equal cells, each big
+    enough for any glyph of the font. Glyphs are added when they are first
+    used, and once every cell is taken the least recently used glyph gives
+    up its cell.
+
+    pixels can be the texels of an atlas saved earlier, whose glyphs are
+    then put back in their cells with place().
+    """
+    # empty texels around each glyph, so linear filtering doesn't pick up
+    # its neighbours
+    PADDING = 1
+
+    def __init__(self, cell_size, columns=16, rows=16, pixels=None):
+        self.cell_size = np.array(cell_size) + 2*self.PADDING
+        self.columns, self.rows = columns, rows
+        width, height = self.cell_size * (self.columns, self.rows)
+        if pixels is None:
+            pixels = np.zeros((height, width), np.uint8)
+        elif pixels.shape != (height, width):
+            raise ValueError("atlas has the wrong size")
+        self.pixels = pixels
+        # the cell of each glyph, least recently used first
+        self.cells = OrderedDict()
+        self.free = list(range(columns*rows))
+        self.texture = self.upload()
+
+    def __contains__(self, key):
+        return key in self.cells
+
+    def touch(self, key):
+        self.cells.move_to_end(key)
+
+    def full(self):
+        return not self.free
+
+    def place(self, key, cell):
+        """Record that the glyph key is already in cell."""
+        self.free.remove(cell)
+        self.cells[key] = cell
+
+    def evict(self):
+        """Free the cell of the least recently used glyph and return its key."""
+        key, cell = self.cells.popitem(last=False)
+        self.free.append(cell)
+        return key
+
+    def add(self, key, bitmap):
+        """Copy bitmap, an array of rows of coverage, into a free cell and
+        return its texture coordinates."""
+        cell = self.cells[key] = self.free.pop()
+        column, row = cell % self.columns, cell // self.columns
+        left, top = self.cell_size * (column, row)
+        x, y = left + self.PADDING, top + self.PADDING
+        # clip the rare glyph that overflows the font's metrics
+        bitmap = bitmap[:self.cell_size[1] - 2*self.PADDING,
+                        :self.cell_size[0] - 2*self.PADDING]
+        h, w = bitmap.shape
+        cell_pixels = self.pixels[top:top + self.cell_size[1], left:left + self.cell_size[0]]
+        cell_pixels[:] = 0
+        self.pixels[y:y + h, x:x + w] = bitmap
+        # upload the whole cell, so nothing is left of the glyph it held before
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.texture)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        gl.glTexSubImage2D(gl.GL_TEXTURE_2D, 0, left, top, *self.cell_size,
+                           gl.GL_RED, gl.GL_UNSIGNED_BYTE,
+                           np.ascontiguousarray(cell_pixels))
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 4)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        height, width = self.pixels.shape
+        return x/width, y/height, (x + w)/width, (y + h)/height
+
+    def upload(self):
+        texture = gl.glGenTextures(1)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, texture)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
+        gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
+        height, width = self.pixels.shape
+        gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_R8, width, height, 0,
+                        gl.GL_RED, gl.GL_UNSIGNED_BYTE, self.pixels)
+        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 4)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        return texture
+
+
 class TextRenderer():
+    """Draws text from a glyph atlas. The quads of all the text rendered in
+    a render() block are collected into one vertex buffer and drawn together
+    at the end of it, as long as they have the same colours.
+
+    Glyphs are rasterised the first time they are used, so any character
+    the font has can be drawn. Quads laid out before evictions changes are
+    no longer valid.
+
+    The atlas holds signed distance fields of the glyphs at SDF_SIZE, which
+    text_frag.glsl draws crisply at any size, so fontsize and scale_factor
+    can be changed without rasterising the glyphs again.
+    """
+    # pixels per em the glyphs are rasterised at, and how far in pixels at
+    # that size their distance fields reach
+    SDF_SIZE = 48
+    SDF_SPREAD = 6
+    ATLAS_GRID = (8, 8)
+    # the characters of the grid labels, which are rasterised ahead of time
+    # and cached on disk, so later starts don't need freetype to draw them
+    PRELOAD = "0123456789.e+\N{MINUS SIGN}"
+
     def __init__(self, fontsize=14, scale_factor=1):
-        self.base, self.texid = 0, 0
         self.width, self.height = 0, 0
-        self.characters = []
+        self.glyphs = {}
+        # number of glyphs evicted from the atlas so far
+        self.evictions = 0
+        self.quads = []
+        self.colors = None
         self.initgl()
-        self.fontsize = fontsize * scale_factor
-        self.makefont(resources.open_binary('plots.res', 'DejaVuSans.ttf'),
-                      self.fontsize)
+        self.fontsize = fontsize
+        self.scale_factor = scale_factor
+        self.makefont(resources.read_binary('plots.res', 'DejaVuSans.ttf'))
 
     def initgl(self):
         vert = resources.read_text("plots.shaders", "text_vert.glsl")
         frag = resources.read_text("plots.shaders", "text_frag.glsl")
         vert = shaders.compileShader(vert, gl.GL_VERTEX_SHADER)
         frag = shaders.compileShader(frag, gl.GL_FRAGMENT_SHADER)
-        self.shaderProgram = shaders.compileProgram(vert, frag)
-        self.vbo = vbo.VBO(np.array([
-            # x y  u  v
-            0, -1, 0, 0,
-            0,  0, 0, 1,
-            1,  0, 1, 1,
-            0, -1, 0, 0,
-            1,  0, 1, 1,
-            1, -1, 1, 0
-        ], 'f'), usage="GL_STATIC_DRAW")
+        self.shaderProgram = Program(shaders.compileProgram(vert, frag))
+        self.vbo = vbo.VBO(np.zeros((6, 4), 'f'), usage="GL_DYNAMIC_DRAW")
         self.vao = gl.glGenVertexArrays(1)
 
         gl.glBindVertexArray(self.vao)
@@ -66,39 +220,132 @@ class TextRenderer():
         self.vbo.unbind()
         gl.glBindVertexArray(0)
 
-    def makefont(self, filename, fontsize):
-        face = freetype.Face(filename)
-        face.set_pixel_sizes(0, fontsize)
+    def makefont(self, font):
+        """Set up the atlas for font, the contents of a font file, from the
+        cache if it is there. The font is only opened with freetype when a
+        glyph has to be rasterised."""
+        self.font = font
+        self.face = None
+        settings = (self.SDF_SIZE, self.SDF_SPREAD, self.ATLAS_GRID, GlyphAtlas.PADDING)
+        key = hashlib.sha1(font + repr(settings).encode()).hexdigest()
+        filename = os.path.join(xdg_cache_home(), "plots", "glyphs-" + key)
+        if self.load_atlas(filename):
+            return
+        metrics = self.open_face().size
+        spread = 2*self.SDF_SPREAD
+        self.cell_size = ((metrics.max_advance >> 6) + spread,
+                          (metrics.height >> 6) + spread)
+        self.atlas = GlyphAtlas(self.cell_size, *self.ATLAS_GRID)
+        self.ascender = metrics.ascender / 64
+        for c in self.PRELOAD:
+            self.glyph(c)
+        self.save_atlas(filename)
 
-        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 1)
-        gl.glActiveTexture(gl.GL_TEXTURE0)
+    def open_face(self):
+        if self.face is None:
+            self.face = freetype.Face(io.BytesIO(self.font))
+            self.face.set_pixel_sizes(0, self.SDF_SIZE)
+        return self.face
 
-        self.top_bearing = 0
-        for c in range(128):
-            face.load_char(chr(c), freetype.FT_LOAD_RENDER)
-            glyph = face.glyph
-            bitmap = glyph.bitmap
-            size = bitmap.width, bitmap.rows
-            bearing = glyph.bitmap_left, glyph.bitmap_top
-            self.top_bearing = max(self.top_bearing, bearing[1])
-            advance = glyph.advance.x
-
-            # create glyph texture
-            texObj = gl.glGenTextures(1)
-            gl.glBindTexture(gl.GL_TEXTURE_2D, texObj)
-            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MAG_FILTER, gl.GL_LINEAR)
-            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_MIN_FILTER, gl.GL_LINEAR)
-            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_S, gl.GL_CLAMP_TO_EDGE)
-            gl.glTexParameteri(gl.GL_TEXTURE_2D, gl.GL_TEXTURE_WRAP_T, gl.GL_CLAMP_TO_EDGE)
-            gl.glTexImage2D(gl.GL_TEXTURE_2D, 0, gl.GL_R8, *size, 0, gl.GL_RED, gl.GL_UNSIGNED_BYTE, bitmap.buffer)
-
-            self.characters.append((texObj, size, bearing, advance))
+    def load_atlas(self, filename):
+        """Read an atlas written by save_atlas, returning whether there was
+        one. The texels are memory mapped and go straight to the texture.
 
-        gl.glPixelStorei(gl.GL_UNPACK_ALIGNMENT, 4)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+        Everything is checked before the texture is made, and a cache which
+        doesn't make sense is deleted, so that it is written again.
+        """
+        try:
+            with open(filename + ".json") as f:
+                metrics = json.load(f)
+            pixels = np.load(filename + ".npy", mmap_mode="c")
+            cell_size = tuple(metrics["cell_size"])
+            ascender = float(metrics["ascender"])
+            cells, glyphs = {}, {}
+            for c, (cell, uv, size, bearing, advance) in metrics["glyphs"].items():
+                numbers = [cell, *uv, *size, *bearing, advance]
+                if (len(uv), len(size), len(bearing)) != (4, 2, 2) \
+                   or not all(isinstance(n, (int, float)) for n in numbers) \
+                   or not isinstance(cell, int) or cell in cells.values() \
+                   or not 0 <= cell < self.ATLAS_GRID[0]*self.ATLAS_GRID[1]:
+                    raise ValueError(f"bad glyph {c!r} in the atlas cache")
+                cells[c] = cell
+                glyphs[c] = Glyph(tuple(uv), tuple(size), tuple(bearing), advance)
+            # checks the size of pixels before making the texture
+            atlas = GlyphAtlas(cell_size, *self.ATLAS_GRID, pixels=pixels)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            for suffix in (".json", ".npy"):
+                try:
+                    os.remove(filename + suffix)
+                except OSError:
+                    pass
+            return False
+        self.cell_size = cell_size
+        self.ascender = ascender
+        self.atlas = atlas
+        for c, cell in cells.items():
+            self.atlas.place(c, cell)
+        self.glyphs.update(glyphs)
+        return True
+
+    def save_atlas(self, filename):
+        """Write the atlas to filename.npy and the metrics of its glyphs to
+        filename.json. Failing to write the cache isn't an error."""
+        metrics = {
+            "cell_size": self.cell_size,
+            "ascender": self.ascender,
+            "glyphs": {c: [cell, *self.glyphs[c]] for c, cell in self.atlas.cells.items()},
+        }
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            # each file is renamed into place once complete, and the metrics
+            # go last, so they are never found without the texels
+            with open(filename + ".npy.tmp", "wb") as f:
+                np.save(f, self.atlas.pixels)
+            os.replace(filename + ".npy.tmp", filename + ".npy")
+            with open(filename + ".json.tmp", "w") as f:
+                json.dump(metrics, f)
+            os.replace(filename + ".json.tmp", filename + ".json")
+        except OSError:
+            pass
+
+    @property
+    def scale(self):
+        """The size of a pixel of the atlas when drawn, in pixels."""
+        return self.fontsize*self.scale_factor/self.SDF_SIZE
+
+    @property
+    def top_bearing(self):
+        # the tallest glyph isn't known until it is loaded, so align to the
+        # ascender instead
+        return math.ceil(self.ascender*self.scale)
+
+    def glyph(self, c):
+        """Return the Glyph of character c, adding it to the atlas if it
+        isn't there."""
+        if c in self.atlas:
+            self.atlas.touch(c)
+            return self.glyphs[c]
+        face = self.open_face()
+        face.load_char(c, freetype.FT_LOAD_RENDER)
+        glyph = face.glyph
+        bitmap = glyph.bitmap
+        spread = self.SDF_SPREAD
+        size = bitmap.width + 2*spread, bitmap.rows + 2*spread
+        bearing = glyph.bitmap_left - spread, glyph.bitmap_top + spread
+        advance = glyph.advance.x / 64
+        pixels = np.array(bitmap.buffer, np.uint8).reshape(bitmap.rows, bitmap.pitch)
+        pixels = signed_distance(pixels[:, :bitmap.width], spread)
+        if self.atlas.full():
+            # the quads waiting to be drawn may use the evicted glyph
+            self.flush()
+            del self.glyphs[self.atlas.evict()]
+            self.evictions += 1
+        uv = self.atlas.add(c, pixels)
+        self.glyphs[c] = Glyph(uv, size, bearing, advance)
+        return self.glyphs[c]
 
     def uniform(self, name):
-        return gl.glGetUniformLocation(self.shaderProgram, name)
+        return self.shaderProgram.uniform(name)
 
     @contextmanager
     def render(self, width, height):
@@ -107,45 +354,89 @@ class TextRenderer():
         proj = glm.ortho(0, self.width, self.height, 0, -1, 1)
         gl.glUniformMatrix4fv(self.uniform("projection"),
                            1, gl.GL_FALSE, glm.value_ptr(proj))
-        yield self
+        try:
+            yield self
+        finally:
+            self.flush()
+
+    def flush(self):
+        """Draw the quads collected so far in one call."""
+        if not self.quads:
+            return
+        self.vbo.set_array(np.concatenate(self.quads))
+        self.quads.clear()
+        gl.glUniform3f(self.uniform("fg_color"), *self.colors[0])
+        gl.glUniform3f(self.uniform("bg_color"), *self.colors[1])
+        gl.glActiveTexture(gl.GL_TEXTURE0)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, self.atlas.texture)
+        gl.glBindVertexArray(self.vao)
+        self.vbo.bind()
+        gl.glDrawArrays(gl.GL_TRIANGLES, 0, len(self.vbo.data))
+        self.vbo.unbind()
+        gl.glBindVertexArray(0)
+        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
 
     def width_of(self, text, scale=1):
-        return sum((self.characters[ord(c)][3] >> 6)*scale for c in text)
+        return sum(self.glyph(c).advance for c in text)*scale*self.scale
 
-    def render_text(self, text, pos, scale=1, dir=(1,0), halign='left',
-                    valign='bottom', text_color=(.0, .0, .0), bg_color=(1., 1., 1.)):
-        offset = glm.vec3()
+    def layout(self, text, scale=1):
+        """Return the vertices (x, y, u, v) of the quads of text, two triangles
+        for each glyph, with the start of the baseline at the origin and y
+        pointing down."""
+        glyphs = [self.glyph(c) for c in text]
+        scale *= self.scale
+        uv = np.array([g.uv for g in glyphs], 'f').reshape(-1, 4)
+        size = np.array([g.size for g in glyphs], 'f').reshape(-1, 2) * scale
+        bearing = np.array([g.bearing for g in glyphs], 'f').reshape(-1, 2) * scale
+        advance = np.array([g.advance for g in glyphs], 'f') * scale
+        left = np.cumsum(advance) - advance + bearing[:, 0]
+        right = left + size[:, 0]
+        top = -bearing[:, 1]
+        bottom = top + size[:, 1]
+        u0, v0, u1, v1 = uv.T
+        corners = [(left, top, u0, v0), (left, bottom, u0, v1), (right, bottom, u1, v1),
+                   (left, top, u0, v0), (right, bottom, u1, v1), (right, top, u1, v0)]
+        return np.stack([np.stack(corner, axis=-1) for corner in corners],
+                        axis=1).reshape(-1, 4)
+
+    def offset(self, text, scale=1, halign='left', valign='bottom'):
+        """Return where the start of the baseline of text goes relative to
+        the position it is aligned to."""
+        offset = np.zeros(2, 'f')
         if halign in ('center', 'right'):
             width = self.width_of(text, scale)
-            offset.x -= width
+            offset[0] -= width
             if halign == 'center':
-                offset.x /= 2
+                offset[0] /= 2
         if valign in ('center', 'top'):
-            offset.y += self.top_bearing
+            offset[1] += self.top_bearing
             if valign == 'center':
-                offset.y /= 2
-        gl.glActiveTexture(gl.GL_TEXTURE0)
-        gl.glBindVertexArray(self.vao)
-        angle_rad = math.atan2(dir[1], dir[0])
-        rotateM = glm.rotate(glm.mat4(1), angle_rad, glm.vec3(0, 0, 1))
-        transOriginM = glm.translate(glm.mat4(1), glm.vec3(*pos, 0) + offset)
-        gl.glUniform3f(self.uniform("fg_color"), *text_color)
-        gl.glUniform3f(self.uniform("bg_color"), *bg_color)
-        char_x = 0
-        for c in text:
-            c = ord(c)
-            ch = self.characters[c]
-            w, h = ch[1][0] * scale, ch[1][1] * scale
-            xrel, yrel = char_x + ch[2][0] * scale, (ch[1][1] - ch[2][1]) * scale
-            char_x += (ch[3] >> 6) * scale
-            scaleM = glm.scale(glm.mat4(1), glm.vec3(w, h, 1))
-            transRelM = glm.translate(glm.mat4(1), glm.vec3(xrel, yrel, 0))
-            modelM = transOriginM * rotateM * transRelM * scaleM
-
-            gl.glUniformMatrix4fv(self.uniform("model"),
-                               1, gl.GL_FALSE, glm.value_ptr(modelM))
-            gl.glBindTexture(gl.GL_TEXTURE_2D, ch[0])
-            gl.glDrawArrays(gl.GL_TRIANGLES, 0, 6)
+                offset[1] /= 2
+        return offset
 
-        gl.glBindVertexArray(0)
-        gl.glBindTexture(gl.GL_TEXTURE_2D, 0)
+    def aligned_layout(self, text, scale=1, halign='left', valign='bottom'):
+        """Return layout(text, scale) moved so that its alignment point is at
+        the origin, ready to be passed to render_quads."""
+        quads = self.layout(text, scale)
+        quads[:, :2] += self.offset(text, scale, halign, valign)
+        return quads
+
+    def render_quads(self, quads, pos, text_color=(.0, .0, .0), bg_color=(1., 1., 1.)):
+        """Draw quads from aligned_layout at pos."""
+        colors = (tuple(text_color), tuple(bg_color))
+        if colors != self.colors:
+            self.flush()
+            self.colors = colors
+        quads = quads.copy()
+        quads[:, :2] += np.asarray(pos, 'f')
+        self.quads.append(quads)
+
+    def render_text(self, text, pos, scale=1, dir=(1,0), halign='left',
+                    valign='bottom', text_color=(.0, .0, .0), bg_color=(1., 1., 1.)):
+        quads = self.layout(text, scale)
+        angle = math.atan2(dir[1], dir[0])
+        if angle:
+            c, s = math.cos(angle), math.sin(angle)
+            quads[:, :2] = quads[:, :2] @ np.array([[c, s], [-s, c]], 'f')
+        quads[:, :2] += self.offset(text, scale, halign, valign)
+        self.render_quads(quads, pos, text_color, bg_color)
@@ -0,0 +1,53 @@
+# Copyright 2022 Alexander Huntley
+
+# This file is part of Plots.
+
+# Plots is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Plots is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+from plots.dependencies import DependencyGraph, Node
+
+def graph(**rows):
+    # each keyword is a row, "name=refs" with refs separated by spaces
+    nodes = {}
+    for row, spec in rows.items():
+        name, _, refs = spec.partition("=")
+        nodes[row] = Node(name or None, set(refs.split()))
+    return DependencyGraph(nodes)
+
+def test_order_puts_dependencies_first():
+    g = graph(f="=b x", b="b=a", a="a=", s="s=")
+    order, cyclic = g.order()
+    assert order == ["a", "b", "f", "s"]
+    assert cyclic == []
+
+def test_order_uses_key_between_independent_rows():
+    g = graph(f="=a x", a="a=", s="s=")
+    priority = {"f": 20, "a": 50, "s": 80}
+    order, _ = g.order(key=lambda row: -priority[row])
+    assert order == ["s", "a", "f"]
+
+def test_cycles_are_not_ordered():
+    g = graph(a="a=b", b="b=a", f="=a", g="=x")
+    order, cyclic = g.order()
+    assert order == ["g"]
+    assert cyclic == ["a", "b", "f"]
+
+def test_dependents():
+    g = graph(a="a=", b="b=a", f="=b", g="=c", h="=x")
+    assert g.dependents({"a"}) == {"b", "f"}
+    # names which aren't defined yet still have dependents
+    assert g.dependents({"c"}) == {"g"}
+
+def test_needed():
+    g = graph(a="a=", b="b=a", c="c=", f="=b")
+    assert g.needed(["f"]) == {"f", "b", "a"}
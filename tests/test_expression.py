@@ -0,0 +1,180 @@
+# Copyright 2022 Alexander Huntley
+
+# This file is part of Plots.
+
+# Plots is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Plots is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+
+import pytest
+
+from plots import expression as ex
+from plots.expression import Num, Var, Neg, BinOp, Call
+
+
+@pytest.mark.parametrize('source, tree', [
+    ("x", Var("x")),
+    ("1.5e3", Num(1500.0)),
+    ("-x*y", BinOp("*", Neg(Var("x")), Var("y"))),
+    ("a-b-c", BinOp("-", BinOp("-", Var("a"), Var("b")), Var("c"))),
+    ("a+b*c", BinOp("+", Var("a"), BinOp("*", Var("b"), Var("c")))),
+    ("mypow(x, (2.0))", Call("mypow", (Var("x"), Num(2.0)))),
+    ("(x)/(.5)", BinOp("/", Var("x"), Num(0.5))),
+])
+def test_parse(source, tree):
+    assert ex.parse(source) == tree
+
+
+@pytest.mark.parametrize('source', ["x+", "(x", "f(x,)", "x y", "x = 1.0"])
+def test_parse_error(source):
+    with pytest.raises(ex.ExpressionError):
+        ex.parse(source)
+
+
+def test_expand_macros():
+    assert ex.expand(ex.parse("sec(x)")) == ex.parse("1.0/cos(x)")
+    assert ex.expand(ex.parse("log_base(2.0, x)")) == ex.parse("log(x)/log(2.0)")
+    assert ex.expand(ex.parse("arcsec(x)")) == ex.parse("acos(1.0/x)")
+
+
+@pytest.mark.parametrize('source, parameters, dual', [
+    ("a*b", ["x"], "vec3((a * b), 0, 0)"),
+    ("3.0*x", ["x"], "(3.0 * x)"),
+    ("x/a", ["x"], "(x / a)"),
+    ("a/x", ["x"], "d_div(vec3(a, 0, 0), x)"),
+    ("x*y+1.0", ["x", "y"], "(d_mul(x, y) + vec3(1.0, 0, 0))"),
+    ("sin(x)-sin(a)", ["x"], "(d_sin(x) - vec3(sin(a), 0, 0))"),
+    ("mypow(x, (2.0))", ["x"], "d_mypow(x, vec3(2.0, 0, 0))"),
+    ("cot(x)", ["x"], "d_div(vec3(1.0, 0, 0), d_tan(x))"),
+])
+def test_to_dual(source, parameters, dual):
+    assert ex.to_dual(ex.parse(source), parameters) == dual
+
+
+def test_to_dual_unknown_function():
+    with pytest.raises(ex.ExpressionError):
+        ex.to_dual(ex.parse("zmod(x, 1.0)"), ["x"])
+
+
+@pytest.mark.parametrize('source, parameters, interval', [
+    ("a*b", ["x"], "vec2((a * b))"),
+    ("x+1.0", ["x"], "(x + 1.0)"),
+    ("1.0-x", ["x"], "(1.0 - x).yx"),
+    ("-x", ["x"], "(-x).yx"),
+    ("x*x", ["x"], "i_sqr(x)"),
+    ("x*y", ["x", "y"], "i_mul(x, y)"),
+    ("a*x", ["x"], "i_scale(x, a)"),
+    ("x/a", ["x"], "i_scale(x, 1.0/a)"),
+    ("x-y", ["x", "y"], "i_sub(x, y)"),
+    ("exp(x)/y", ["x", "y"], "i_div(i_exp(x), y)"),
+])
+def test_to_interval(source, parameters, interval):
+    assert ex.to_interval(ex.parse(source), parameters) == interval
+
+
+@pytest.mark.parametrize('source, folded', [
+    ("2.0*3.0+x", "6.0+x"),
+    ("2.0*pi", "6.283185307179586"),
+    ("x*1.0+0.0", "x"),
+    ("x+(-2.0)", "x-2.0"),
+    ("sqrt(4.0)*x", "2.0*x"),
+    ("log(0.0-1.0)", "log(-1.0)"),
+    ("1.0/0.0", "1.0/0.0"),
+])
+def test_fold(source, folded):
+    assert ex.fold(ex.parse(source)) == ex.fold(ex.parse(folded))
+
+
+@pytest.mark.parametrize('source, reduced', [
+    ("mypow(x, (2.0))", "x*x"),
+    ("mypow(x, (3.0))", "x*x*x"),
+    ("mypow(x, (4.0))", "(x*x)*(x*x)"),
+    ("mypow(x, (-2.0))", "1.0/(x*x)"),
+    ("mypow(x, (0.5))", "mypow(x, 0.5)"),
+])
+def test_strength_reduce(source, reduced):
+    assert ex.strength_reduce(ex.fold(ex.parse(source))) == ex.parse(reduced)
+
+
+def test_horner():
+    tree = ex.optimise(ex.parse("mypow(x, (3.0))-2.0*mypow(x, (2.0))+x-1.0"), ["x"])
+    assert tree == ex.parse("(((x-2.0)*x+1.0)*x)-1.0")
+    # a lone power is left to strength reduction
+    tree = ex.optimise(ex.parse("mypow(x, (4.0))+1.0"), ["x"])
+    assert tree == ex.parse("(x*x)*(x*x)+1.0")
+
+
+def test_to_statements():
+    tree = ex.optimise(ex.parse("sin(mypow(x, (2.0)))+cos(mypow(x, (2.0)))"), ["x"])
+    assert ex.to_statements(tree) == \
+        ("float _t0 = (x * x);\n", "(sin(_t0) + cos(_t0))")
+
+
+def test_to_statements_nested():
+    tree = ex.optimise(ex.parse("sin(mypow(x, (2.0)))+sin(mypow(x, (2.0)))"), ["x"])
+    assert ex.to_statements(tree) == \
+        ("float _t0 = sin((x * x));\n", "(_t0 + _t0)")
+    # x*x is used on its own as well as inside the repeated sine
+    tree = ex.optimise(ex.parse("sin(mypow(x, (2.0)))*sin(mypow(x, (2.0)))+mypow(x, (2.0))"), ["x"])
+    assert ex.to_statements(tree) == \
+        ("float _t0 = (x * x);\nfloat _t1 = sin(_t0);\n", "((_t1 * _t1) + _t0)")
+
+
+def test_factorial_limits():
+    assert ex.glsl_factorial(170.0) == pytest.approx(math.factorial(170))
+    assert ex.glsl_factorial(1e9) == math.inf
+    assert math.isnan(ex.glsl_factorial(-1.0))
+    assert math.isnan(ex.glsl_factorial(math.inf))
+    # not folded, rather than folded to infinity
+    assert ex.fold(ex.parse("factorial(1e9)")) == ex.parse("factorial(1e9)")
+
+
+def test_invariant():
+    assert ex.invariant(ex.parse("sin(a)*2.0"), {"a"})
+    assert not ex.invariant(ex.parse("sin(a)*x"), {"a"})
+    assert not ex.invariant(ex.parse("unknown(a)"), {"a"})
+
+
+@pytest.mark.parametrize('source, values, result', [
+    ("a*2.0+1.0", {"a": 3.0}, 7.0),
+    ("mypow(a, (2.0))", {"a": -3.0}, 9.0),
+    ("mypow(a, (3.0))", {"a": -2.0}, -8.0),
+    ("factorial(a)", {"a": 4.0}, 24.0),
+    ("sqrt(a)", {"a": 4.0}, 2.0),
+    ("sqrt(a)", {"a": -1.0}, math.nan),
+    ("1.0/a", {"a": 0.0}, math.inf),
+    ("b", {}, math.nan),
+])
+def test_evaluate(source, values, result):
+    value = ex.evaluate(ex.parse(source), values)
+    if math.isnan(result):
+        assert math.isnan(value)
+    else:
+        assert value == pytest.approx(result)
+
+
+def test_hoist():
+    tree, invariants = ex.hoist(ex.parse("sin(a*2.0)*x+sin(a*2.0)+b"), {"a", "b"}, "_h")
+    assert tree == ex.parse("_h0*x+_h0+b")
+    assert invariants == {"_h0": ex.parse("sin(a*2.0)")}
+
+
+def test_lift():
+    tree, values = ex.lift(ex.parse("2.5*x+sin(3.0*x)*sin(3.0*x)+2.5"), "_c")
+    assert ex.to_glsl(tree) == \
+        "(((_c[0] * x) + (sin((_c[1] * x)) * sin((_c[1] * x)))) + _c[2])"
+    assert values == [2.5, 3.0, 2.5]
+    # trees which only differ in their numbers give the same code
+    other, _ = ex.lift(ex.parse("2.6*x+sin(3.0*x)*sin(3.0*x)+1.0"), "_c")
+    assert ex.to_glsl(other) == ex.to_glsl(tree)
@@ -0,0 +1,53 @@
+# Copyright 2022 Alexander Huntley
+
+# This file is part of Plots.
+
+# Plots is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Plots is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+from plots import formularow
+
+
+def rows():
+    slider = formularow.Slider(None, "", "a=2", None)
+    variable = formularow.Variable(None, "", "b=a*2.0")
+    formula = formularow.Formula(None, "b*x", "", None)
+    return slider, variable, formula
+
+
+def test_with_dependencies():
+    slider, variable, formula = rows()
+    formulae = [slider, variable, formula]
+    assert formularow.with_dependencies(slider, formulae) == [slider]
+    # a Variable's own name isn't a dependency of it
+    assert formularow.with_dependencies(variable, formulae) == [slider, variable]
+    assert formularow.with_dependencies(formula, formulae) == [slider, variable, formula]
+
+
+def test_dependency_graph():
+    slider, variable, formula = rows()
+    graph = formularow.dependency_graph([formula, variable, slider])
+    ordered, unplaceable = graph.order()
+    assert ordered == [slider, variable, formula]
+    assert unplaceable == []
+
+
+def test_duplicate_sliders():
+    # both sliders define "a", so Plots.update_shader only keeps the first
+    first = formularow.Slider(None, "", "a=2", None)
+    second = formularow.Slider(None, "", "a=3", None)
+    formula = formularow.Formula(None, "a*x", "", None)
+    graph = formularow.dependency_graph([first, second, formula])
+    assert graph.definers["a"] == [first, second]
+    ordered, unplaceable = graph.order()
+    assert ordered.index(formula) > max(ordered.index(first), ordered.index(second))
@@ -0,0 +1,52 @@
+# Copyright 2022 Alexander Huntley
+
+# This file is part of Plots.
+
+# Plots is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Plots is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+from plots.quality import QualityController
+
+def test_over_budget_reduces_samples_first():
+    q = QualityController(samples=32)
+    q.update(elapsed=32, budget=16)
+    assert q.samples == 16
+    assert q.scale == 1.0
+
+def test_reduces_scale_at_minimum_samples():
+    q = QualityController(samples=QualityController.MIN_SAMPLES)
+    q.update(elapsed=32, budget=16)
+    assert q.samples == QualityController.MIN_SAMPLES
+    assert q.scale < 1.0
+
+def test_under_budget_restores_scale_first():
+    q = QualityController(samples=QualityController.MIN_SAMPLES)
+    q.scale = 0.5
+    q.update(elapsed=4, budget=16)
+    assert q.scale > 0.5
+    assert q.samples == QualityController.MIN_SAMPLES
+
+def test_within_budget_unchanged():
+    q = QualityController(samples=32)
+    q.update(elapsed=12, budget=16)
+    assert (q.samples, q.scale) == (32, 1.0)
+
+def test_limits():
+    q = QualityController(samples=QualityController.MAX_SAMPLES)
+    q.update(elapsed=1, budget=16)
+    assert q.samples == QualityController.MAX_SAMPLES
+    assert q.scale == 1.0
+    for _ in range(20):
+        q.update(elapsed=1000, budget=16)
+    assert q.samples == QualityController.MIN_SAMPLES
+    assert q.scale == QualityController.MIN_SCALE
@@ -0,0 +1,35 @@
+# Copyright 2022 Alexander Huntley
+
+# This file is part of Plots.
+
+# Plots is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Plots is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from plots import formularow
+
+
+@pytest.mark.parametrize("row_type, expr", [
+    (formularow.Formula, "a*x"),
+    (formularow.ImplicitFormula, "a*x=y"),
+])
+def test_prepass_templates(row_type, expr):
+    slider = formularow.Slider(None, "", "a=2", None)
+    row = row_type(None, expr, "", None)
+    slider.slot, row.slot = 0, 1
+    row.prepass = True
+    source = row.prepass_template.render(formulae=[slider, row], formula=row)
+    assert "a = slider_values[0][0];" in source
+    assert "load_sliders();" in source
+    assert "float formula1(" in source
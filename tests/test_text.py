@@ -0,0 +1,62 @@
+# Copyright 2022 Alexander Huntley
+
+# This file is part of Plots.
+
+# Plots is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Plots is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Plots.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+from plots.text import GlyphAtlas, TextRenderer
+
+CELL_SIZE = (10, 12)
+GLYPH = [[0.0, 0.0, 0.1, 0.1], [8, 10], [1, 10], 9.0]
+
+
+def write_cache(filename, metrics, pixels=None):
+    if pixels is None:
+        columns, rows = TextRenderer.ATLAS_GRID
+        pixels = np.zeros(((CELL_SIZE[1] + 2*GlyphAtlas.PADDING)*rows,
+                           (CELL_SIZE[0] + 2*GlyphAtlas.PADDING)*columns), np.uint8)
+    np.save(filename + ".npy", pixels)
+    with open(filename + ".json", "w") as f:
+        f.write(metrics if isinstance(metrics, str) else json.dumps(metrics))
+
+
+@pytest.mark.parametrize("metrics, pixels", [
+    # truncated
+    ('{"cell_size": [10, 12], "ascender": 9.0, "gly', None),
+    # a cell outside the atlas
+    ({"cell_size": CELL_SIZE, "ascender": 9.0, "glyphs": {"1": [999, *GLYPH]}}, None),
+    # two glyphs in one cell
+    ({"cell_size": CELL_SIZE, "ascender": 9.0,
+      "glyphs": {"1": [0, *GLYPH], "2": [0, *GLYPH]}}, None),
+    # metrics missing
+    ({"cell_size": CELL_SIZE, "ascender": 9.0, "glyphs": {"1": [0, [0.0], [8], 9.0]}}, None),
+    # texels not matching the cell size
+    ({"cell_size": CELL_SIZE, "ascender": 9.0, "glyphs": {}}, np.zeros((3, 3), np.uint8)),
+])
+def test_corrupt_cache(tmp_path, metrics, pixels):
+    filename = str(tmp_path / "glyphs")
+    write_cache(filename, metrics, pixels)
+    renderer = TextRenderer.__new__(TextRenderer)
+    renderer.glyphs = {}
+    assert not renderer.load_atlas(filename)
+    assert renderer.glyphs == {}
+    # it is deleted, so that a good one is written in its place
+    assert not os.path.exists(filename + ".json")
+    assert not os.path.exists(filename + ".npy")